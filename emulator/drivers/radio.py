@@ -49,9 +49,13 @@ class Radio:
     def listen(self):
         self.listening = True
 
+    def rx_done(self):
+        return not self._rx_queue.empty()
+
     def receive(self, *, keep_listening=True, with_header=False, with_ack=False, timeout=None, debug=False):
-        rx_time = self._rx_time_bias + (random.random() - 0.5) * self._rx_time_dev
-        time.sleep(rx_time)
+        if timeout != 0:
+            rx_time = self._rx_time_bias + (random.random() - 0.5) * self._rx_time_dev
+            time.sleep(rx_time)
         if self._rx_queue.empty():
             return None
         return self._rx_queue.get().observe()
@@ -14,6 +14,7 @@ import time
 from binascii import hexlify
 
 # Argus-1 Lib
+import core.scheduler as scheduler
 from apps.comms.radio_protocol import IMAGES, Definitions, construct_message
 
 # PyCubed Board Lib
@@ -223,37 +224,107 @@ class SATELLITE_RADIO:
     def receive_message(self):
         while self.gs_req_ack == 0:
             my_packet = self.sat.RADIO.receive(timeout=1)
-            if my_packet is None:
-                self.heartbeat_sent = False
-                self.gs_req_message_ID = 0x00
-                self.gs_req_ack = 1
-            else:
-                # print(f"Received (raw bytes): {my_packet}")
-                crc_check = self.sat.RADIO.crc_error()
-                # print(f"CRC Status: {crc_check}")
+            self.handle_rx_packet(my_packet)
+
+        self.gs_req_ack = 0
+        return self.heartbeat_sent
 
-                if crc_check > 0:
-                    self.crc_count += 1
+    """
+        Name: receive_message_async
+        Description: Same as receive_message, but waits for the LoRa module from the scheduler
+        so other tasks keep running until a packet is received or the timeout expires
+    """
 
-                # rssi = self.sat.RADIO.rssi(raw=True)
-                # print(f"Received signal strength: {rssi} dBm")
-                self.unpack_message(my_packet)
+    async def receive_message_async(self, timeout=1, poll_hz=50):
+        while self.gs_req_ack == 0:
+            self.sat.RADIO.listen()
+            await scheduler.wait_for(self.sat.RADIO.rx_done, timeout, poll_hz)
+            # Packet already in the FIFO (or timed out), read it without waiting again
+            my_packet = self.sat.RADIO.receive(timeout=0)
+            self.handle_rx_packet(my_packet)
 
         self.gs_req_ack = 0
         return self.heartbeat_sent
 
+    """
+        Name: handle_rx_packet
+        Description: Process the result of a receive call, None meaning no packet was received
+    """
+
+    def handle_rx_packet(self, my_packet):
+        if my_packet is None:
+            self.heartbeat_sent = False
+            self.gs_req_message_ID = 0x00
+            self.gs_req_ack = 1
+        else:
+            # print(f"Received (raw bytes): {my_packet}")
+            crc_check = self.sat.RADIO.crc_error()
+            # print(f"CRC Status: {crc_check}")
+
+            if crc_check > 0:
+                self.crc_count += 1
+
+            # rssi = self.sat.RADIO.rssi(raw=True)
+            # print(f"Received signal strength: {rssi} dBm")
+            self.unpack_message(my_packet)
+
     """
         Name: transmit_message
         Description: SAT transmits message via the LoRa module when the function is called.
     """
 
     def transmit_message(self):
+        for tx_message in self.tx_messages():
+            time.sleep(0.15)
+            self.send_tx_message(tx_message)
+
+        return int.from_bytes(tx_message[0:1], "big") & 0b01111111
+
+    """
+        Name: transmit_message_async
+        Description: Same as transmit_message, but the delay between packets is a scheduler sleep
+        so other tasks keep running during multi-packet transmissions.
+    """
+
+    async def transmit_message_async(self):
+        for tx_message in self.tx_messages():
+            await scheduler.sleep(0.15)
+            self.send_tx_message(tx_message)
+
+        return int.from_bytes(tx_message[0:1], "big") & 0b01111111
+
+    """
+        Name: send_tx_message
+        Description: Send one message to the GS via the LoRa module
+    """
+
+    def send_tx_message(self, tx_message):
+        # TODO: remove
+        msg = hexlify(bytes([0xFF, 0xFF, 0x00, 0x00]) + tx_message)
+        print(f"[100][SERIAL OUTPUT]:{msg}")
+        # Send a message to GS
+        self.sat.RADIO.send(tx_message)
+        self.crc_count = 0
+
+        # # # Debug output of message in bytes
+        # print(
+        #     "Satellite sent message with ID:",
+        #     int.from_bytes(tx_message[0:1], "big") & 0b01111111,
+        # )
+        # print("\n")
+
+    """
+        Name: tx_messages
+        Description: Generator of the messages to send for the current GS request.
+        Each message must be sent before the next one is generated.
+    """
+
+    def tx_messages(self):
         send_multiple = True
         multiple_packet_count = -1
         target_sequence_count = 0
 
         while send_multiple:
-            time.sleep(0.15)
             # Check if currently transmitting an image and CRC error has been 0
             if (self.gs_req_message_ID == Definitions.SAT_IMG1_CMD) and (self.crc_count == 0):
                 target_sequence_count = self.sat_images.image_message_count
@@ -341,18 +412,4 @@ class SATELLITE_RADIO:
                 # Transmit SAT heartbeat or ACK
                 tx_message = construct_message(self.gs_req_message_ID)
 
-            # TODO: remove
-            msg = hexlify(bytes([0xFF, 0xFF, 0x00, 0x00]) + tx_message)
-            print(f"[100][SERIAL OUTPUT]:{msg}")
-            # Send a message to GS
-            self.sat.RADIO.send(tx_message)
-            self.crc_count = 0
-
-            # # # Debug output of message in bytes
-            # print(
-            #     "Satellite sent message with ID:",
-            #     int.from_bytes(tx_message[0:1], "big") & 0b01111111,
-            # )
-            # print("\n")
-
-        return int.from_bytes(tx_message[0:1], "big") & 0b01111111
+            yield tx_message
@@ -13,6 +13,7 @@ LENGTH     : 1 byte
 Authors: DJ Morvay, Akshat Sahay
 """
 
+import core.scheduler as scheduler
 from core.data_handler import DataHandler as DH
 
 
@@ -159,11 +160,8 @@ def construct_message(lora_tx_message_ID):
         # Add system status
         lora_tx_message += [0x00, 0x00]
 
-        # Get latest values from IMU task
-        if DH.data_process_exists("imu"):
-            imu_data = DH.get_latest_data("imu")
-        else:
-            imu_data = None
+        # Latest sample published by the IMU task (time, accel, mag and gyro values in the order of its data_keys)
+        imu_data = scheduler.get_channel("imu").last
 
         if imu_data is None:
             # Add magnetometer values
@@ -180,17 +178,17 @@ def construct_message(lora_tx_message_ID):
 
         else:
             # Add magnetometer values
-            lora_tx_message += convert_fixed_point(imu_data["mag_x"])
-            lora_tx_message += convert_fixed_point(imu_data["mag_y"])
-            lora_tx_message += convert_fixed_point(imu_data["mag_z"])
+            lora_tx_message += convert_fixed_point(imu_data[4])
+            lora_tx_message += convert_fixed_point(imu_data[5])
+            lora_tx_message += convert_fixed_point(imu_data[6])
 
             # Add gyroscope values
-            lora_tx_message += convert_fixed_point(imu_data["gyro_x"])
-            lora_tx_message += convert_fixed_point(imu_data["gyro_y"])
-            lora_tx_message += convert_fixed_point(imu_data["gyro_z"])
+            lora_tx_message += convert_fixed_point(imu_data[7])
+            lora_tx_message += convert_fixed_point(imu_data[8])
+            lora_tx_message += convert_fixed_point(imu_data[9])
 
             # Add time reference as uint32_t
-            time = imu_data["time"]
+            time = int(imu_data[0])
             lora_tx_message += [
                 (time >> 24) & 0xFF,
                 (time >> 16) & 0xFF,
@@ -12,11 +12,17 @@ Author(s): Sachit Goyal, Harry Rosmann
 
 from time import sleep
 
+import core.scheduler as scheduler
 from apps.jetson_comms.msg import Definitions, Message
 from core.data_handler import DataHandler as DH
 
 MAX_RETRIES = 3
 
+# Async receive: how long to wait for the header / each packet and how often the UART is polled
+HEADER_TIMEOUT = 1.0
+PACKET_TIMEOUT = 0.5
+UART_POLL_HZ = 200
+
 
 class ArgusComm:
     def __init__(self, uart):
@@ -53,6 +59,9 @@ class ArgusComm:
     def close_logger(self):
         DH.image_completed()
 
+    def discard_logger(self):
+        DH.image_discarded()
+
     def receive_message(self) -> bool:
         timeout = 100
         expected_seq_num = 0
@@ -116,3 +125,54 @@ class ArgusComm:
         self.close_logger()
 
         return True
+
+    async def receive_message_async(self) -> bool:
+        """
+        Same as receive_message, but waits for the UART from the scheduler so other tasks
+        keep running while the Jetson is sending. Gives up if the header does not arrive within
+        HEADER_TIMEOUT or if any packet does not arrive within PACKET_TIMEOUT.
+        """
+        uart = self.uart
+
+        if not await scheduler.wait_for(
+            lambda: uart.in_waiting() >= Definitions.HEADER_PKT_SIZE, HEADER_TIMEOUT, UART_POLL_HZ
+        ):
+            uart.reset_input_buffer()
+            return False
+
+        header = uart.read(Definitions.HEADER_PKT_SIZE)
+        uart.reset_input_buffer()
+
+        (seq_num, packet_type, payload_size) = Message.parse_packet_meta(header)
+
+        if packet_type != Definitions.PKT_TYPE_HEADER:
+            raise RuntimeError("Invalid header")
+
+        (message_type, num_packets) = Message.parse_header_payload(header[Definitions.PKT_METADATA_SIZE :])
+
+        uart.write(Message.create_ack(seq_num))
+        expected_seq_num = seq_num + 1
+
+        def packet_ready():
+            return uart.in_waiting() >= Definitions.PACKET_SIZE
+
+        while expected_seq_num != num_packets + 1:
+            if not await scheduler.wait_for(packet_ready, PACKET_TIMEOUT, UART_POLL_HZ):
+                # Jetson stopped sending, the image is incomplete and must not be downlinked
+                uart.reset_input_buffer()
+                self.discard_logger()
+                return False
+
+            packet = uart.read(Definitions.PACKET_SIZE)
+
+            (seq_num, packet_type, payload_size) = Message.parse_packet_meta(packet)
+
+            if packet_type == Definitions.PKT_TYPE_DATA and seq_num == expected_seq_num:
+                expected_seq_num += 1
+            uart.write(Message.create_ack(expected_seq_num - 1))
+            payload = packet[Definitions.PKT_METADATA_SIZE :][:payload_size]
+            self.log_data(payload)
+
+        self.close_logger()
+
+        return True
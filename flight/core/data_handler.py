@@ -28,6 +28,7 @@ Data format (character: byte size):
 
 """
 
+import binascii
 import json
 import os
 import re
@@ -46,10 +47,52 @@ _CLOSED = const(20)
 _OPEN = const(21)
 _IMG_SIZE_LIMIT = const(1000000)  # 1MB
 
+# Write-behind buffer defaults: flush one SD sector at a time, or when the oldest buffered record is this old (s)
+_FLUSH_BYTES = const(512)
+_FLUSH_AGE = const(10)
+# Image data is staged in RAM and written to the SD card four sectors at a time
+_IMG_FLUSH_BYTES = const(2048)
+
+# Retention: default priority of the data processes (lower values are kept longer, as for task priorities)
+# and maximum number of files evicted per call to DataHandler.enforce_quotas()
+_RETENTION_PRIORITY = const(8)
+_MAX_EVICTIONS = const(4)
+# Share of the SD card capacity the data files may use when no total quota is configured (percent)
+_TOTAL_QUOTA_PERCENT = const(90)
+
 
 _PROCESS_CONFIG_FILENAME = ".process_configuration.json"
+# Configuration of every data process, at the root of the SD card, read in one go at boot
+_MANIFEST_FILENAME = ".manifest.json"
 _IMG_TAG_NAME = "img"
 
+# Segment index: one fixed-size record (start time, size in bytes, state) per data file, in chronological order
+_INDEX_FILENAME = ".segment_index.bin"
+_INDEX_FORMAT = "<IIB"
+_INDEX_RECORD_SIZE = const(9)
+
+# Segment states
+_SEG_ACTIVE = const(0)  # Currently written to
+_SEG_CLOSED = const(1)  # Complete, available for transmission
+_SEG_EXCLUDED = const(2)  # Being transmitted, excluded from clean-up
+_SEG_DELETE = const(3)  # Transmission acknowledged, pending deletion
+_SEG_RAW = const(0x80)  # Flag on the state of a segment left uncompressed by a failed compression
+
+# Optional record framing: sync marker before and CRC (lower 16 bits of the CRC-32) after each record
+_SYNC_MARKER = const(0xA5)
+_CRC_FORMAT = "<H"
+_FRAMING_SIZE = const(3)
+
+# Compressed encoding: +/-_QUANT_INF encode infinities and _QUANT_NAN a NaN, finite fixed-point values are always
+# smaller in magnitude (a float times its scale overflows to inf before reaching 2**1024)
+_QUANT_INF = 1 << 1024
+_QUANT_NAN = _QUANT_INF + 1
+_INF = float("inf")
+_NAN = float("nan")
+
+# Segments are stored in one subdirectory per period (named start // _BUCKET_SECONDS) to bound the directory sizes
+_BUCKET_SECONDS = const(3600)
+
 
 class DataProcess:
     """
@@ -68,6 +111,20 @@ class DataProcess:
         dir_path (str): The directory path for the file.
         current_path (str): The current filename.
         bytesize (int): The size of each new data line to be written to the file.
+        crc (bool): Whether each record is framed with a sync marker and a CRC in the file.
+        record_size (int): The size of each record in the file (bytesize, plus the framing if crc is enabled).
+        quantization (dict): Scale factor of each float field for the compressed encoding of the closed files
+            (None for no compression).
+        columnar (bool): Whether the records are stored in the file as blocks of per-field columns.
+        flush_bytes (int): The buffered size that triggers a write to the file.
+        flush_age (int): The maximum time (in seconds) a record can stay in the write-behind buffer.
+        quota (int): The maximum number of bytes the process can store on the SD card (None for no limit).
+        retention_priority (int): Processes with a higher value are evicted first when the SD card is over quota.
+        history_size (int): The number of most recent records kept in RAM (0 for none).
+        index (bytearray): The start time, size and state of each data file, in chronological order (segment index),
+            packed with the format of the index file. See segment().
+        excluded (int): The position in the index of the segment being transmitted (None if there is none).
+        closed_cursor (int): The position in the index before which no segment is closed, see next_segment().
     """
 
     _FORMAT = {
@@ -94,6 +151,16 @@ class DataProcess:
         line_limit: int = 1000,
         new_config_file: bool = False,
         home_path: str = "/sd",
+        flush_bytes: int = _FLUSH_BYTES,
+        flush_age: int = _FLUSH_AGE,
+        quota: Optional[int] = None,
+        retention_priority: int = _RETENTION_PRIORITY,
+        history_size: int = 0,
+        exists: bool = False,
+        crc: bool = False,
+        quantization: Optional[dict] = None,
+        columnar: bool = False,
+        cluster_size: int = 1,
     ) -> None:
         """
         Initializes a DataProcess object.
@@ -106,43 +173,126 @@ class DataProcess:
             line_limit (int, optional): The maximum number of data lines allowed in the file (default is 1000).
             new_config_file (bool, optional): Whether to create a new configuration file (default is False).
             home_path (str, optional): The home path for the file (default is "/sd/").
+            flush_bytes (int, optional): Size of the writes to the file, ideally a multiple of the SD sector size (default is 512).
+            flush_age (int, optional): Maximum time in seconds a record can stay in RAM before being written (default is 10).
+            quota (int, optional): Maximum number of bytes stored on the SD card, the oldest files are evicted beyond it
+                (default is None, no limit).
+            retention_priority (int, optional): Eviction order between processes when the SD card is over quota,
+                higher values are evicted first (default is 8).
+            history_size (int, optional): Number of most recent records kept in a RAM ring buffer, see get_history()
+                (default is 0, only the latest data point is kept).
+            exists (bool, optional): Whether the folder and configuration file of the process are known to exist
+                (e.g. listed in the manifest), to skip checking them on the SD card (default is False).
+            crc (bool, optional): Whether to frame each record in the file with a sync marker and a CRC, so that
+                corrupted records can be detected and skipped (default is False).
+            quantization (dict, optional): Enables the compressed encoding of the files when they are closed. Maps
+                each float field to the scale factor of its fixed-point representation, e.g. {"accel_x": 1000} for
+                a resolution of 0.001 (default is None, files are not compressed).
+            columnar (bool, optional): Whether to store the records as blocks of per-field columns, written when the
+                write buffer is flushed, so that reading a few fields only reads their columns (default is False).
+                Not available with crc or quantization.
+            cluster_size (int, optional): Allocation unit of the SD card file system, the space taken by each file
+                is rounded up to it in get_allocated_size() (default is 1, sizes are not rounded).
+
+        Raises:
+            ValueError: If a float field has no scale factor in the quantization, or if columnar is combined with
+                crc or quantization.
         """
 
         self.tag_name = tag_name
         self.data_keys = data_keys
         self.file = None
         self.persistent = persistent
+        self.quota = quota
+        self.retention_priority = retention_priority
 
         # TODO Check formating e.g. 'iff', 'iif', 'fff', 'iii', etc. ~ done within compute_bytesize()
         self.data_format = "<" + data_format
         # Need to specify endianness to disable padding (https://stackoverflow.com/questions/47750056/python-struct-unpack-length-error/47750278#47750278)
         self.bytesize = self.compute_bytesize(self.data_format)
+        self.crc = crc
+        self.record_size = self.bytesize + _FRAMING_SIZE if crc else self.bytesize
+
+        # Compressed encoding: fixed-point values (integer fields are kept as is), delta to the previous record, zigzag varint
+        self.quantization = quantization
+        if quantization is not None:
+            self.scales = []
+            for key, c in zip(data_keys, data_format):
+                if c in "fd":
+                    if key not in quantization:
+                        raise ValueError(f"No quantization for the float field '{key}'")
+                    self.scales.append(quantization[key])
+                else:
+                    self.scales.append(None)
+
+        # Columnar layout: blocks of block_records records, each block holding the values of the first field of its
+        # records, then of the second field, etc. Only the last block of a closed file can hold fewer records.
+        self.columnar = columnar
+        if columnar:
+            if crc or quantization is not None:
+                raise ValueError("The columnar layout cannot be combined with crc or quantization.")
+            self.block_records = max(flush_bytes // self.bytesize, 1)
+            self.block_bytes = self.block_records * self.bytesize
+            self.column_buffer = bytearray(self.block_bytes)
+            self.field_layout = []  # (offset in a record, size) of each field
+            self.field_formats = []
+            offset = 0
+            for c in data_format:
+                self.field_layout.append((offset, self._FORMAT[c]))
+                self.field_formats.append("<" + c)
+                offset += self._FORMAT[c]
 
         self.last_data = {}
+        self.last_values = None  # Set by log_values(), converted to last_data only when requested
+
+        # History ring buffer, records packed back to back with the process format
+        self.history_size = history_size
+        self.history_buffer = bytearray(history_size * self.bytesize)
+        self.history_head = 0  # Position of the next record to write
+        self.history_count = 0
 
         if self.persistent:
 
             self.status = _CLOSED
 
             self.dir_path = home_path + "/" + tag_name + "/"
-            self.create_folder()
+            if not exists:
+                self.create_folder()
 
             # To Be Resolved for each file process, TODO check if int, positive, etc
-            self.size_limit = line_limit * self.bytesize  # Default size limit is 1000 data lines
-
-            self.current_path = self.create_new_path()
-            self.delete_paths = []  # Paths that are flagged for deletion
-            self.excluded_paths = []  # Paths that are currently being transmitted
-
+            self.size_limit = line_limit * self.record_size  # Default size limit is 1000 data lines
+
+            self.current_path = None
+
+            # Write-behind buffer, with room for one record past flush_bytes so records are never split
+            self.flush_bytes = flush_bytes
+            self.flush_age = flush_age
+            self.write_buffer = bytearray(flush_bytes + self.record_size)
+            self.buffered = 0  # Number of bytes in the write buffer
+            self.buffer_time = 0  # Time at which the oldest buffered record was logged
+
+            # Storage accounting, kept in memory so that logging never has to stat the SD card
+            self.cluster_size = cluster_size
+            self.file_size = 0  # Bytes written to the current file
+            self.load_index()
+
+            self.config_data = {
+                "data_format": self.data_format[1:],  # remove the < character
+                "line_limit": line_limit,
+                "data_keys": data_keys,
+                "quota": quota,
+                "retention_priority": retention_priority,
+                "crc": crc,
+                "quantization": quantization,
+                "columnar": columnar,
+                "flush_bytes": flush_bytes,  # Sets the block size of the columnar layout
+                "flush_age": flush_age,
+                "history_size": history_size,
+            }
             config_file_path = self.dir_path + _PROCESS_CONFIG_FILENAME
-            if not path_exist(config_file_path) or new_config_file:
-                config_data = {
-                    "data_format": self.data_format[1:],  # remove the < character
-                    "line_limit": line_limit,
-                    "data_keys": data_keys,
-                }
+            if new_config_file or (not exists and not path_exist(config_file_path)):
                 with open(config_file_path, "w") as config_file:
-                    json.dump(config_data, config_file)
+                    json.dump(self.config_data, config_file)
 
     def create_folder(self) -> None:
         """
@@ -186,14 +336,159 @@ class DataProcess:
         Returns:
             None
         """
-        self.resolve_current_file()
         self.last_data = data
+        self.last_values = None
 
-        if self.persistent:
+        if self.persistent or self.history_size:
             values = [data[key] for key in self.data_keys]
-            bin_data = struct.pack(self.data_format, *values)
-            self.file.write(bin_data)
-            self.file.flush()  # Flush immediately
+            if self.history_size:
+                self.history_record(values)
+            if self.persistent:
+                self.resolve_current_file()
+                self.buffer_record(values)
+
+    def log_values(self, *values) -> None:
+        """
+        Logs a data point given as values in the order of data_keys (eventually to a file if persistent = True).
+        Unlike log(), no dictionary is needed: the values are packed directly into the write buffer.
+
+        Args:
+            *values: The values of the data point.
+
+        Returns:
+            None
+        """
+        self.last_values = values
+
+        if self.history_size:
+            self.history_record(values)
+        if self.persistent:
+            self.resolve_current_file()
+            self.buffer_record(values)
+
+    def history_record(self, values) -> None:
+        """
+        Packs a record in the history ring buffer, overwriting the oldest one when it is full.
+
+        Args:
+            values: The values of the record, in the order of data_keys.
+        """
+        struct.pack_into(self.data_format, self.history_buffer, self.history_head * self.bytesize, *values)
+        self.history_head = (self.history_head + 1) % self.history_size
+        if self.history_count < self.history_size:
+            self.history_count += 1
+
+    def get_history(self, n: Optional[int] = None, fields: Optional[List[str]] = None):
+        """
+        Generator over the most recent records of the history ring buffer, oldest first.
+
+        Args:
+            n (int, optional): Number of records (default is all the records in the history).
+            fields (List[str], optional): Keys of the values to return for each record (default is all data_keys).
+
+        Yields:
+            A tuple with the requested values of each record.
+        """
+        if n is None or n > self.history_count:
+            n = self.history_count
+        projection = None if fields is None else [self.data_keys.index(field) for field in fields]
+
+        for r in range(self.history_head - n, self.history_head):
+            values = struct.unpack_from(self.data_format, self.history_buffer, (r % self.history_size) * self.bytesize)
+            yield values if projection is None else tuple(values[k] for k in projection)
+
+    def buffer_record(self, values) -> None:
+        """
+        Packs a record at the end of the write-behind buffer and writes the buffer to the file
+        once it holds flush_bytes or its oldest record is older than flush_age.
+
+        Args:
+            values: The values of the record, in the order of data_keys.
+        """
+        if self.buffered == 0:
+            self.buffer_time = time.time()
+        if self.crc:
+            self.write_buffer[self.buffered] = _SYNC_MARKER
+            struct.pack_into(self.data_format, self.write_buffer, self.buffered + 1, *values)
+            payload = memoryview(self.write_buffer)[self.buffered + 1 : self.buffered + 1 + self.bytesize]
+            struct.pack_into(
+                _CRC_FORMAT, self.write_buffer, self.buffered + 1 + self.bytesize, binascii.crc32(payload) & 0xFFFF
+            )
+        else:
+            struct.pack_into(self.data_format, self.write_buffer, self.buffered, *values)
+        self.buffered += self.record_size
+
+        if self.buffered >= self.flush_bytes:
+            # Only write whole multiples of flush_bytes, the remainder stays buffered
+            self.flush(whole=False)
+        elif time.time() - self.buffer_time >= self.flush_age:
+            self.flush()
+
+    def check_record(self, buffer, offset: int = 0) -> bool:
+        """
+        Checks the sync marker and CRC of the framed record at the given offset of a buffer.
+        Always True if the process does not use CRCs.
+        """
+        if not self.crc:
+            return True
+        if buffer[offset] != _SYNC_MARKER:
+            return False
+        payload = memoryview(buffer)[offset + 1 : offset + 1 + self.bytesize]
+        return binascii.crc32(payload) & 0xFFFF == struct.unpack_from(_CRC_FORMAT, buffer, offset + 1 + self.bytesize)[0]
+
+    def flush(self, whole: bool = True, closing: bool = False) -> None:
+        """
+        Writes the write-behind buffer to the file.
+
+        Args:
+            whole (bool, optional): Write the entire buffer (default). If False, only a multiple
+                of flush_bytes is written and the remainder is kept for the next write.
+            closing (bool, optional): The file is being closed. With the columnar layout, only complete
+                blocks are written until then, so a whole flush with a partial block left closes the file
+                and the next record starts a new one.
+        """
+        if self.buffered == 0 or self.status != _OPEN:
+            return
+
+        if self.columnar:
+            if whole and not closing and self.buffered % self.block_bytes:
+                # Only the last block of a file can be partial
+                self.close()
+                return
+            size = self.buffered if closing else self.buffered - self.buffered % self.block_bytes
+            if size == 0:
+                return
+            self.write_columns(size)
+        else:
+            size = self.buffered if whole else self.buffered - self.buffered % self.flush_bytes
+            self.file.write(memoryview(self.write_buffer)[:size])
+        self.file.flush()
+        self.file_size += size
+        self.total_size += size
+
+        remainder = self.buffered - size
+        if remainder:
+            self.write_buffer[:remainder] = self.write_buffer[size : self.buffered]
+        self.buffered = remainder
+
+    def write_columns(self, size: int) -> None:
+        """
+        Transposes the first size bytes of the write buffer into column blocks and writes them to the file.
+
+        Args:
+            size (int): Number of bytes to write, a multiple of the block size unless the file is being closed.
+        """
+        rows = memoryview(self.write_buffer)
+        for block_start in range(0, size, self.block_bytes):
+            k = min(self.block_bytes, size - block_start) // self.bytesize
+            for field_offset, field_size in self.field_layout:
+                column = k * field_offset
+                row = block_start + field_offset
+                for _ in range(k):
+                    self.column_buffer[column : column + field_size] = rows[row : row + field_size]
+                    column += field_size
+                    row += self.bytesize
+            self.file.write(memoryview(self.column_buffer)[: k * self.bytesize])
 
     def get_latest_data(self) -> dict:
         """
@@ -205,6 +500,10 @@ class DataProcess:
         Returns:
             The latest data point or None if no data point has been logged yet.
         """
+        if self.last_values is not None:
+            self.last_data = dict(zip(self.data_keys, self.last_values))
+            self.last_values = None
+
         if self.last_data is not None:
             return self.last_data
         else:
@@ -220,27 +519,283 @@ class DataProcess:
             self.current_path = self.create_new_path()
             self.open()
         elif self.status == _OPEN:
-            current_file_size = self.get_current_file_size()
-            if current_file_size >= self.size_limit:
+            if self.get_current_file_size() >= self.size_limit:
                 self.close()
                 self.current_path = self.create_new_path()
                 self.open()
 
     def create_new_path(self) -> str:
         """
-        Create a new filename for the current file process.
+        Create a new segment (data file) for the current file process and add it to the segment index.
+        Start times are kept unique and increasing, so that the index stays sorted.
 
         Returns:
             str: The new filename.
         """
         # TODO timestamp must be obtained through the REFERENCE TIME until the time module is done
-        return self.dir_path + self.tag_name + "_" + str(time.time()) + ".bin"
+        start = int(time.time())
+        n = self.segment_count()
+        last = self.segment_time(n - 1) if n else None
+        if last is not None and start <= last:
+            start = last + 1
+
+        if last is None or last // _BUCKET_SECONDS != start // _BUCKET_SECONDS:
+            try:
+                os.mkdir(self.dir_path + str(start // _BUCKET_SECONDS))
+            except OSError:
+                pass  # Bucket already exists
+
+        record = struct.pack(_INDEX_FORMAT, start, 0, _SEG_ACTIVE)
+        self.index += record
+        with open(self.dir_path + _INDEX_FILENAME, "ab") as index_file:
+            index_file.write(record)
+        return self.segment_path(start)
+
+    def segment_path(self, start: int) -> str:
+        """
+        Returns the path of the segment starting at the given time, within its bucket subdirectory.
+        """
+        return self.dir_path + str(start // _BUCKET_SECONDS) + "/" + self.tag_name + "_" + str(start) + ".bin"
+
+    def segment_start(self, file_name: str) -> Optional[int]:
+        """
+        Returns the start time of the segment with the given file name, or None if it is not a segment file name.
+        """
+        prefix = self.tag_name + "_"
+        if not (file_name.startswith(prefix) and file_name.endswith(".bin")):
+            return None
+        try:
+            return int(file_name[len(prefix) : -4])
+        except ValueError:
+            return None
+
+    def find_segment(self, path: Optional[str]) -> Optional[int]:
+        """
+        Returns the position of the segment with the given path in the index (binary search on the start time),
+        or None if the path is not a segment of this process.
+        """
+        if path is None:
+            return None
+        start = self.segment_start(path[path.rfind("/") + 1 :])
+        if start is None or path != self.segment_path(start):
+            return None
+
+        n = self.segment_count()
+        low, high = 0, n
+        while low < high:
+            mid = (low + high) // 2
+            if self.segment_time(mid) < start:
+                low = mid + 1
+            else:
+                high = mid
+        if low < n and self.segment_time(low) == start:
+            return low
+        return None
+
+    def segment_count(self) -> int:
+        """
+        Returns the number of segments in the index.
+        """
+        return len(self.index) // _INDEX_RECORD_SIZE
+
+    def segment(self, i: int) -> Tuple[int, int, int]:
+        """
+        Returns the start time, size and state of the i-th segment of the index.
+        """
+        start, size, state = struct.unpack_from(_INDEX_FORMAT, self.index, i * _INDEX_RECORD_SIZE)
+        return start, size, state & ~_SEG_RAW
+
+    def segment_time(self, i: int) -> int:
+        """
+        Returns the start time of the i-th segment of the index.
+        """
+        return struct.unpack_from("<I", self.index, i * _INDEX_RECORD_SIZE)[0]
+
+    def segment_size(self, i: int) -> int:
+        """
+        Returns the size of the i-th segment of the index.
+        """
+        return struct.unpack_from("<I", self.index, i * _INDEX_RECORD_SIZE + 4)[0]
+
+    def segment_state(self, i: int) -> int:
+        """
+        Returns the state of the i-th segment of the index.
+        """
+        return self.index[i * _INDEX_RECORD_SIZE + 8] & ~_SEG_RAW
+
+    def set_segment(self, i: int, size: int, state: int) -> None:
+        """
+        Updates the size and state of the i-th segment, in memory and in place in the index file.
+        The _SEG_RAW flag of the segment is kept.
+        """
+        offset = i * _INDEX_RECORD_SIZE
+        struct.pack_into("<IB", self.index, offset + 4, size, state | (self.index[offset + 8] & _SEG_RAW))
+        if state == _SEG_EXCLUDED:
+            self.excluded = i
+        elif i == self.excluded:
+            self.excluded = None
+        with open(self.dir_path + _INDEX_FILENAME, "r+b") as index_file:
+            index_file.seek(offset)
+            index_file.write(memoryview(self.index)[offset : offset + _INDEX_RECORD_SIZE])
+
+    def write_index(self) -> None:
+        """
+        Rewrites the whole index file from the in-memory index.
+        """
+        with open(self.dir_path + _INDEX_FILENAME, "wb") as index_file:
+            index_file.write(self.index)
+
+    def load_index(self) -> None:
+        """
+        Loads the segment index from the SD card and initializes the storage counters from it.
+        The index is rebuilt from the directory listing if it is missing.
+
+        Segments left active or excluded by a reset are closed (their transmission will be requested again).
+        The index file is read in place into the in-memory index, which is compacted if segments are dropped.
+        """
+        self.index = bytearray()
+        self.excluded = None
+        self.closed_cursor = 0
+        trimmed = []  # Recovered segments rewritten without their torn tail
+        try:
+            with open(self.dir_path + _INDEX_FILENAME, "rb") as index_file:
+                index_size = os.stat(self.dir_path + _INDEX_FILENAME)[6]
+                self.index = bytearray(index_size - index_size % _INDEX_RECORD_SIZE)
+                index_file.readinto(self.index)
+        except OSError:
+            self.rebuild_index()
+        else:
+            n = 0  # Segments kept
+            for offset in range(0, len(self.index), _INDEX_RECORD_SIZE):
+                start, size, state = struct.unpack_from(_INDEX_FORMAT, self.index, offset)
+                raw = state & _SEG_RAW
+                state &= ~_SEG_RAW
+                if state == _SEG_ACTIVE:
+                    try:
+                        size, file_size = self.recover_segment(start)
+                    except OSError:
+                        continue
+                    struct.pack_into(_INDEX_FORMAT, self.index, n * _INDEX_RECORD_SIZE, start, size, _SEG_CLOSED | raw)
+                    if self.quantization is not None:
+                        struct.pack_into("<I", self.index, n * _INDEX_RECORD_SIZE + 4, self.try_compress_segment(n))
+                    if size != file_size and not self.is_compressed(n):
+                        try:
+                            self.copy_segment(self.segment_path(start), size)
+                            trimmed.append(n)
+                        except OSError as e:
+                            # TODO log
+                            print(f"Could not rewrite {self.segment_path(start)} ({e}), the torn tail is kept.")
+                            try:
+                                os.remove(self.segment_path(start) + ".tmp")
+                            except OSError:
+                                pass  # Not created
+                    n += 1
+                    continue
+                elif state == _SEG_EXCLUDED:
+                    state = _SEG_CLOSED
+                struct.pack_into(_INDEX_FORMAT, self.index, n * _INDEX_RECORD_SIZE, start, size, state | raw)
+                n += 1
+            if n < self.segment_count():
+                self.index = self.index[: n * _INDEX_RECORD_SIZE]
+
+        self.write_index()
+        for i in trimmed:
+            self.replace_segment(i)
+        n = self.segment_count()
+        if self.quantization is not None and n:
+            # Compressed file written but not yet renamed when the software was reset
+            self.replace_segment(n - 1)
+        self.file_count = n
+        self.total_size = sum(self.segment_size(i) for i in range(n))
+        self.allocated_size = self.compute_allocated_size()
+
+    def recover_segment(self, start: int) -> Tuple[int, int]:
+        """
+        Returns the size of the valid part of a segment that was being written when the software was reset,
+        and the size of its file.
+
+        A torn record at the end of the file is left out. If the process uses CRCs, the records written by the last
+        buffer flush are also checked, from the end, and the corrupted ones left out. The file is not modified,
+        load_index() rewrites it without the invalid part once the index holds the valid size.
+        """
+        path = self.segment_path(start)
+        file_size = os.stat(path)[6]
+        size = file_size - file_size % (self.block_bytes if self.columnar else self.record_size)
+
+        if self.crc:
+            buffer = bytearray(self.record_size)
+            with open(path, "rb") as file:
+                checked = 0
+                while size > 0 and checked < self.flush_bytes:
+                    file.seek(size - self.record_size)
+                    file.readinto(buffer)
+                    if self.check_record(buffer):
+                        break
+                    size -= self.record_size
+                    checked += self.record_size
+
+        if size != file_size:
+            # TODO log
+            print(f"Recovered {size} bytes of {path}.")
+        return size, file_size
+
+    def copy_segment(self, path: str, size: int) -> None:
+        """
+        Writes the first size bytes of a segment file next to it, see replace_segment().
+        """
+        buffer = memoryview(self.write_buffer)  # Nothing buffered before the index is loaded
+        with open(path, "rb") as file, open(path + ".tmp", "wb") as copy:
+            while size > 0:
+                n = file.readinto(buffer[: min(size, len(buffer))])
+                if not n:
+                    break
+                copy.write(buffer[:n])
+                size -= n
+
+    def rebuild_index(self) -> None:
+        """
+        Rebuilds the in-memory index from the files of the bucket subdirectories.
+        Segment files found directly in the process directory (flat layout) are moved to their bucket.
+        """
+        segments = []
+        for entry in os.listdir(self.dir_path):
+            entry_path = self.dir_path + entry
+            if os.stat(entry_path)[0] & 0x4000:  # Bucket directory
+                for file_name in os.listdir(entry_path):
+                    start = self.segment_start(file_name)
+                    if start is None:
+                        # TODO log
+                        print(f"Ignoring file {file_name}, not a segment.")
+                        continue
+                    segments.append((start, os.stat(entry_path + "/" + file_name)[6]))
+            else:
+                start = self.segment_start(entry)
+                if start is None:
+                    continue
+                try:
+                    os.mkdir(self.dir_path + str(start // _BUCKET_SECONDS))
+                except OSError:
+                    pass  # Bucket already exists
+                os.rename(entry_path, self.segment_path(start))
+                segments.append((start, os.stat(self.segment_path(start))[6]))
+        segments.sort(key=lambda segment: segment[0])
+
+        self.index = bytearray(len(segments) * _INDEX_RECORD_SIZE)
+        for i, (start, size) in enumerate(segments):
+            struct.pack_into(_INDEX_FORMAT, self.index, i * _INDEX_RECORD_SIZE, start, size, _SEG_CLOSED)
 
     def open(self) -> None:
         """
         Open the file for writing.
+        This is the only place where the size of the current file is read from the SD card.
         """
         if self.status == _CLOSED:
+            try:
+                # Appending to an existing file
+                self.file_size = os.stat(self.current_path)[6]
+            except OSError:
+                self.file_size = 0
+                self.file_count += 1
             self.file = open(self.current_path, "ab+")
             self.status = _OPEN
         else:
@@ -248,11 +803,23 @@ class DataProcess:
 
     def close(self) -> None:
         """
-        Close the file.
+        Close the file, after writing any buffered data.
         """
         if self.status == _OPEN:
+            self.flush(closing=True)
             self.file.close()
             self.status = _CLOSED
+            # The active segment is always the last one
+            i = self.segment_count() - 1
+            size = self.file_size
+            if self.quantization is not None:
+                struct.pack_into("<I", self.index, i * _INDEX_RECORD_SIZE + 4, self.file_size)
+                size = self.try_compress_segment(i)
+                self.total_size += size - self.file_size
+            self.set_segment(i, size, _SEG_CLOSED)
+            self.allocated_size += self.allocation(size)
+            if self.quantization is not None:
+                self.replace_segment(i)
         else:
             print("File is already closed.")
 
@@ -263,147 +830,559 @@ class DataProcess:
 
         The function store the file path to be excluded in clean-up policies.
         Once fully transmitted, notify_TM_path() must be called to remove the file from the exclusion list.
+
+        The oldest complete file is returned (the most recent one if latest=True). The file currently
+        written to is closed and returned if it holds the requested data. A file being transmitted is
+        returned again until it is acknowledged.
         """
-        # Assumes correct ordering (monotonic timestamp)
-        # TODO
-        files = os.listdir(self.dir_path)
-        if len(files) > 1:  # Ignore process configuration file
+        i = self.next_segment(_SEG_EXCLUDED, latest)
+        if i is None:
+            if self.status == _OPEN and self.get_current_file_size() > 0:
+                if latest or self.next_segment(_SEG_CLOSED) is None:
+                    self.close()
+                    self.resolve_current_file()
 
-            if latest:
-                transmit_file = files[-1]
-                if transmit_file == _PROCESS_CONFIG_FILENAME:
-                    transmit_file = files[-2]
-            else:
-                transmit_file = files[0]
-                if transmit_file == _PROCESS_CONFIG_FILENAME:
-                    transmit_file = files[1]
+            i = self.next_segment(_SEG_CLOSED, latest)
+            if i is None:
+                return None
+            self.set_segment(i, self.segment_size(i), _SEG_EXCLUDED)
 
-            tm_path = self.dir_path + transmit_file
+        return self.segment_path(self.segment_time(i))
 
-            if tm_path == self.current_path:
-                self.close()
-                self.resolve_current_file()
+    def next_segment(self, state: int, latest: bool = False) -> Optional[int]:
+        """
+        Returns the position in the index of the oldest segment in the given state (the most recent one if latest=True),
+        or None if there is no such segment. Only _SEG_CLOSED and _SEG_EXCLUDED segments are looked up.
 
-            self.excluded_paths.append(tm_path)
-            return tm_path
-        else:
+        There is at most one excluded segment, tracked by set_segment(). The oldest closed segment is found from a
+        cursor before which no segment can be closed: the segments it skips are excluded or pending deletion, and
+        the active segment, which is always the last one, stops it.
+        """
+        if state == _SEG_EXCLUDED:
+            return self.excluded
+
+        n = self.segment_count()
+        if latest:
+            for i in range(n - 1, -1, -1):
+                if self.segment_state(i) == _SEG_CLOSED:
+                    return i
             return None
 
+        i = self.closed_cursor
+        while i < n:
+            segment_state = self.segment_state(i)
+            if segment_state == _SEG_CLOSED:
+                break
+            if segment_state == _SEG_ACTIVE:
+                return None
+            i += 1
+        self.closed_cursor = i
+        return i if i < n else None
+
     def notify_TM_path(self, path: str) -> None:
         """
         Acknowledge the transmission of the file.
         The file is then removed from the excluded list and added to the deletion list.
         """
-        if path in self.excluded_paths:
-            self.excluded_paths.remove(path)
-            self.delete_paths.append(path)
+        i = self.find_segment(path)
+        if i is not None and self.segment_state(i) == _SEG_EXCLUDED:
+            self.set_segment(i, self.segment_size(i), _SEG_DELETE)
             # TODO handle case where comms transmitted a file it wasn't suposed to
         else:
             # TODO log
             print("No file to acknowledge.")
 
+    def evict_oldest(self) -> Optional[int]:
+        """
+        Flags the oldest complete file for deletion, to be removed by the next clean_up().
+        Files being transmitted and the file currently written to are never evicted.
+
+        Returns:
+            The size of the evicted file in bytes, or None if there is no file to evict.
+        """
+        i = self.next_segment(_SEG_CLOSED)
+        if i is None:
+            return None
+        size = self.segment_size(i)
+        self.set_segment(i, size, _SEG_DELETE)
+        return size
+
     def clean_up(self) -> None:
         """
         Clean up the files that have been transmitted and acknowledged.
+        Bucket subdirectories left without segments are removed.
+        """
+        count = self.segment_count()
+        n = 0  # Segments kept, compacted in place at the start of the index
+        buckets = []  # Buckets of the deleted segments
+        for i in range(count):
+            start, size, state = self.segment(i)
+            if state != _SEG_DELETE:
+                if n < i:
+                    source = i * _INDEX_RECORD_SIZE
+                    target = n * _INDEX_RECORD_SIZE
+                    self.index[target : target + _INDEX_RECORD_SIZE] = self.index[source : source + _INDEX_RECORD_SIZE]
+                    if i == self.excluded:
+                        self.excluded = n
+                n += 1
+                continue
+            try:
+                os.remove(self.segment_path(start))
+            except OSError:
+                # TODO - log error
+                print(f"File {self.segment_path(start)} does not exist.")
+            self.file_count -= 1
+            self.total_size -= size
+            self.allocated_size -= self.allocation(size)
+            if start // _BUCKET_SECONDS not in buckets:
+                buckets.append(start // _BUCKET_SECONDS)
+
+        if n < count:
+            self.index = self.index[: n * _INDEX_RECORD_SIZE]
+            self.closed_cursor = 0
+            self.write_index()
+
+        for i in range(n):
+            if self.segment_time(i) // _BUCKET_SECONDS in buckets:
+                buckets.remove(self.segment_time(i) // _BUCKET_SECONDS)
+        for bucket in buckets:
+            try:
+                os.rmdir(self.dir_path + str(bucket))
+            except OSError:
+                # TODO - log error
+                print(f"Bucket {self.dir_path + str(bucket)} could not be removed.")
+
+    def scan_storage(self) -> Tuple[int, int]:
         """
-        for d_path in self.delete_paths:
-            if path_exist(d_path):
-                os.remove(d_path)
-            else:
-                # TODO - log error, use exception handling instead
-                print(f"File {d_path} does not exist.")
+        Counts the files of the process on the SD card and their total size.
+        The counters are normally derived from the segment index, this is a consistency check.
 
-            self.delete_paths.remove(d_path)
+        Returns:
+            A tuple containing the number of files and their total size in bytes.
+        """
+        file_count = 0
+        total_size = 0
+        for entry in os.listdir(self.dir_path):
+            if entry == _PROCESS_CONFIG_FILENAME or entry == _INDEX_FILENAME:
+                continue
+            stats = os.stat(self.dir_path + entry)
+            if stats[0] & 0x4000:  # Bucket directory
+                for file_name in os.listdir(self.dir_path + entry):
+                    file_count += 1
+                    total_size += os.stat(self.dir_path + entry + "/" + file_name)[6]
+            else:
+                file_count += 1
+                total_size += stats[6]
+        return file_count, total_size
 
     def get_storage_info(self) -> Tuple[int, int]:
         """
         Returns storage information for the current file process which includes:
         - Number of files in the directory
-        - Total directory size in bytes
-        - TODO
+        - Total size of the files in bytes, including the data not yet written from the buffer
 
         Returns:
             A tuple containing the number of files and the total directory size.
         """
-        files = os.listdir(self.dir_path)
-        # TODO - implement the rest of the function
-        total_size = len(files) * self.size_limit + self.get_current_file_size()
-        return len(files), total_size
+        return self.file_count, self.total_size + self.buffered
+
+    def allocation(self, size: int) -> int:
+        """
+        Returns the space taken on the SD card by a file of the given size, a whole number of clusters.
+        """
+        return -(-size // self.cluster_size) * self.cluster_size
 
-    def get_current_file_size(self) -> Optional[int]:
+    def compute_allocated_size(self) -> int:
         """
-        Get the current size of the file.
+        Returns the space taken on the SD card by the segments of the index, except the one being written.
+        """
+        return sum(
+            self.allocation(self.segment_size(i)) for i in range(self.segment_count()) if self.segment_state(i) != _SEG_ACTIVE
+        )
+
+    def get_allocated_size(self) -> int:
+        """
+        Returns the space taken on the SD card by the files of the process, including the data not yet written
+        from the buffer. FAT allocates whole clusters, so small files take more space than their size.
 
         Returns:
-            Optional[int]: The size of the file in bytes, or None if there was an error or the file does not exist.
+            int: The allocated size in bytes.
         """
-        if path_exist(self.current_path):
-            try:
-                file_stats = os.stat(self.current_path)
-                filesize = file_stats[6]  # size of the file in bytes
-                return filesize
-            except OSError as e:
-                # TODO log
-                print(f"Error getting file size: {e}")
-                return None
+        if self.status == _OPEN:
+            return self.allocated_size + self.allocation(self.file_size + self.buffered)
+        return self.allocated_size
+
+    def get_current_file_size(self) -> int:
+        """
+        Get the current size of the file, including the data not yet written from the buffer.
+
+        Returns:
+            int: The size of the file in bytes.
+        """
+        return self.file_size + self.buffered
+
+    def query(self, t_start, t_end, fields: Optional[List[str]] = None):
+        """
+        Generator over the records whose "time" value is between t_start and t_end (inclusive), in chronological order.
+
+        The first segment to read is found in the segment index, the first record within it by a binary search on
+        the record offsets. Reading stops at the first record past t_end. Records still in the write buffer are
+        included.
+
+        Args:
+            t_start: Start of the time range.
+            t_end: End of the time range.
+            fields (List[str], optional): Keys of the values to return for each record (default is all data_keys).
+
+        Yields:
+            A tuple with the requested values of each matching record.
+
+        Raises:
+            ValueError: If the process has no "time" key or a field is not one of its data keys.
+        """
+        time_index = self.data_keys.index("time")
+        projection = None if fields is None else [self.data_keys.index(field) for field in fields]
+        # Position and format of the time value within a record
+        time_offset = self.compute_bytesize(self.data_format[: time_index + 1]) + (1 if self.crc else 0)
+        time_format = "<" + self.data_format[time_index + 1]
+        time_size = self.compute_bytesize(time_format)
+
+        # Last segment starting before t_start (start times are in the same base as the time values)
+        n = self.segment_count()
+        low, high = 0, n
+        while low < high:
+            mid = (low + high) // 2
+            if self.segment_time(mid) <= t_start:
+                low = mid + 1
+            else:
+                high = mid
+        first = max(low - 1, 0)
+
+        for i in range(first, n):
+            if self.is_compressed(i):
+                # No random access in compressed files, records are decoded from the start
+                for values in self.read_segment(i):
+                    if values[time_index] > t_end:
+                        return
+                    if values[time_index] >= t_start:
+                        yield values if projection is None else tuple(values[k] for k in projection)
+                continue
+
+            n = self.segment_records(i)
+            with open(self.segment_path(self.segment_time(i)), "rb") as file:
+                # First record with time >= t_start
+                low, high = 0, n
+                while low < high:
+                    mid = (low + high) // 2
+                    if self.columnar:
+                        file.seek(self.column_offset(mid, n, time_index))
+                    else:
+                        file.seek(mid * self.record_size + time_offset)
+                    if struct.unpack(time_format, file.read(time_size))[0] < t_start:
+                        low = mid + 1
+                    else:
+                        high = mid
+
+            for values in self.read_segment(i, start_record=low):
+                if values[time_index] > t_end:
+                    return
+                if values[time_index] >= t_start:
+                    yield values if projection is None else tuple(values[k] for k in projection)
+
+    def column_offset(self, r: int, n: int, field: int) -> int:
+        """
+        Returns the position in a columnar file of n records of the value of the given field of the r-th record.
+        """
+        block = r // self.block_records
+        k = min(self.block_records, n - block * self.block_records)
+        field_offset, field_size = self.field_layout[field]
+        return block * self.block_bytes + k * field_offset + (r - block * self.block_records) * field_size
+
+    def is_compressed(self, i: int) -> bool:
+        """
+        Returns whether the i-th segment uses the compressed encoding (all closed segments if quantization is set,
+        except those kept raw after a failed compression).
+        """
+        if self.quantization is None or (self.status == _OPEN and i == self.segment_count() - 1):
+            return False
+        return not self.index[i * _INDEX_RECORD_SIZE + 8] & _SEG_RAW
+
+    def segment_records(self, i: int) -> int:
+        """
+        Returns the number of records written to the SD card in the i-th segment (not compressed).
+        """
+        if self.status == _OPEN and i == self.segment_count() - 1:
+            return self.file_size // self.record_size
+        return self.segment_size(i) // self.record_size
+
+    def read_segment(self, i: int = -1, start_record: int = 0, fields: Optional[List[str]] = None):
+        """
+        Generator over the records of a segment, read one at a time into a single reusable buffer.
+
+        The active segment is read without closing it: the records written to the SD card are followed by the records
+        still in the write buffer. If the process uses CRCs, corrupted records are skipped.
+
+        Args:
+            i (int, optional): Position of the segment in the index (default is -1, the most recent segment).
+            start_record (int, optional): Number of records to skip (default is 0).
+            fields (List[str], optional): Keys of the values to return for each record (default is all data_keys).
+
+        Yields:
+            A tuple with the requested values of each record.
+        """
+        if i < 0:
+            i += self.segment_count()
+        projection = None if fields is None else [self.data_keys.index(field) for field in fields]
+
+        if self.columnar:
+            # Only the requested columns are read
+            yield from self.read_columnar_segment(i, start_record, projection)
+            return
+        if self.is_compressed(i):
+            records = self.read_compressed_segment(i, start_record)
         else:
-            # TODO handle case where file does not exist
-            print("File does not exist.")
-            return None
+            records = self.read_raw_segment(i, start_record)
+        for values in records:
+            yield values if projection is None else tuple(values[k] for k in projection)
+
+    def read_raw_segment(self, i: int, start_record: int = 0):
+        """
+        Generator over the records of a segment stored with the fixed-size binary format, see read_segment().
+        """
+        payload_offset = 1 if self.crc else 0
+        # The write buffer continues the file, a record can be split between them
+        active = self.status == _OPEN and i == self.segment_count() - 1
+        disk_size = self.file_size if active else self.segment_size(i)
+        size = disk_size + self.buffered if active else disk_size
+
+        buffer = bytearray(self.record_size)
+        with open(self.segment_path(self.segment_time(i)), "rb") as file:
+            file.seek(start_record * self.record_size)
+            for r in range(start_record, size // self.record_size):
+                offset = r * self.record_size
+                if offset + self.record_size <= disk_size:
+                    file.readinto(buffer)
+                    record, record_offset = buffer, 0
+                elif offset >= disk_size:
+                    record, record_offset = self.write_buffer, offset - disk_size
+                else:
+                    head = disk_size - offset
+                    file.readinto(memoryview(buffer)[:head])
+                    buffer[head:] = self.write_buffer[: self.record_size - head]
+                    record, record_offset = buffer, 0
+
+                if not self.check_record(record, record_offset):
+                    # TODO log
+                    print(f"Skipping corrupted record {r} of {self.segment_path(self.segment_time(i))}.")
+                    continue
+                yield struct.unpack_from(self.data_format, record, record_offset + payload_offset)
+
+    def read_columnar_segment(self, i: int, start_record: int = 0, projection: Optional[List[int]] = None):
+        """
+        Generator over the records of a segment stored with the columnar layout, see read_segment().
+        Each block is read one column at a time into a reusable buffer, skipping the columns not in the projection.
+        The records of the active segment still in the write buffer are not transposed yet.
+
+        Args:
+            projection (List[int], optional): Positions of the fields to return (default is all the fields).
+        """
+        fields = range(len(self.field_layout)) if projection is None else projection
+        n = self.segment_records(i)
+
+        block = bytearray(self.block_bytes)
+        with open(self.segment_path(self.segment_time(i)), "rb") as file:
+            r = start_record
+            while r < n:
+                block_index = r // self.block_records
+                block_start = block_index * self.block_records
+                k = min(self.block_records, n - block_start)
+                for f in fields:
+                    field_offset, field_size = self.field_layout[f]
+                    file.seek(block_index * self.block_bytes + k * field_offset)
+                    file.readinto(memoryview(block)[k * field_offset : k * (field_offset + field_size)])
+                for j in range(r - block_start, k):
+                    yield tuple(
+                        struct.unpack_from(
+                            self.field_formats[f], block, k * self.field_layout[f][0] + j * self.field_layout[f][1]
+                        )[0]
+                        for f in fields
+                    )
+                r = block_start + k
+
+        if self.status == _OPEN and i == self.segment_count() - 1:
+            for offset in range(max(start_record - n, 0) * self.bytesize, self.buffered, self.bytesize):
+                values = struct.unpack_from(self.data_format, self.write_buffer, offset)
+                yield values if projection is None else tuple(values[f] for f in projection)
+
+    def read_compressed_segment(self, i: int, start_record: int = 0):
+        """
+        Generator over the records of a segment stored with the compressed encoding, see read_segment().
+        The file is read in small chunks into a reusable buffer and the varints are decoded across chunks.
+        """
+        n_fields = len(self.scales)
+        values = [0] * n_fields
+        field = 0
+        r = 0
+        z = 0
+        shift = 0
+
+        chunk = bytearray(64)
+        with open(self.segment_path(self.segment_time(i)), "rb") as file:
+            while True:
+                n = file.readinto(chunk)
+                if not n:
+                    return
+                for k in range(n):
+                    b = chunk[k]
+                    z |= (b & 0x7F) << shift
+                    if b & 0x80:
+                        shift += 7
+                        continue
+                    values[field] += (z >> 1) ^ -(z & 1)  # Zigzag decoding of the delta
+                    z = 0
+                    shift = 0
+                    field += 1
+                    if field == n_fields:
+                        field = 0
+                        if r >= start_record:
+                            yield tuple(v if scale is None else _dequantize(v, scale) for v, scale in zip(values, self.scales))
+                        r += 1
+
+    def compress_segment(self, i: int) -> int:
+        """
+        Rewrites a closed segment with the compressed encoding: each value is converted to fixed-point with the
+        quantization scale of its field (see _quantize()), the difference with the previous record is zigzag encoded
+        and written as a varint (7 bits per byte, high bit set on all but the last byte). Varints are not limited
+        in size, so that any integer is encoded exactly.
+
+        The compressed file is written next to the original. The original is replaced by replace_segment(), once the
+        index holds the compressed size, so that a reset at any point leaves either file consistent with the index.
+
+        Returns:
+            The size of the compressed segment in bytes.
+        """
+        path = self.segment_path(self.segment_time(i))
+        previous = [0] * len(self.scales)
+        out = self.write_buffer  # Free once the segment is closed
+        n = 0
+        size = 0
+
+        with open(path + ".tmp", "wb") as file:
+            for values in self.read_raw_segment(i):
+                for f in range(len(values)):
+                    scale = self.scales[f]
+                    q = values[f] if scale is None else _quantize(values[f], scale)
+                    delta = q - previous[f]
+                    previous[f] = q
+                    z = delta << 1 if delta >= 0 else ((-delta) << 1) - 1
+                    while True:
+                        if n == len(out):
+                            file.write(out)
+                            size += n
+                            n = 0
+                        if z < 0x80:
+                            out[n] = z
+                            n += 1
+                            break
+                        out[n] = (z & 0x7F) | 0x80
+                        n += 1
+                        z >>= 7
+            file.write(memoryview(out)[:n])
+            size += n
+
+        return size
+
+    def try_compress_segment(self, i: int) -> int:
+        """
+        Compresses the i-th segment with compress_segment() and returns its new size. If the compression fails, the
+        segment is kept raw (flagged in the index) and its current size is returned, the error is not raised.
+        """
+        try:
+            return self.compress_segment(i)
+        except (OSError, ValueError, OverflowError) as e:
+            path = self.segment_path(self.segment_time(i))
+            # TODO log
+            print(f"Compression of {path} failed ({e}), the segment is kept raw.")
+            self.index[i * _INDEX_RECORD_SIZE + 8] |= _SEG_RAW
+            try:
+                os.remove(path + ".tmp")
+            except OSError:
+                pass  # Not created
+            return self.segment_size(i)
+
+    def replace_segment(self, i: int) -> None:
+        """
+        Replaces a segment file with the version written next to it by compress_segment() or copy_segment(), if there
+        is one.
+        """
+        path = self.segment_path(self.segment_time(i))
+        if not path_exist(path + ".tmp"):
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # Already removed before the reset
+        os.rename(path + ".tmp", path)
 
     # DEBUG ONLY
     def read_current_file(self) -> List[Tuple[Any, ...]]:
         """
-        Reads the content of the current file.
+        Reads the content of the current file, including the data not yet written from the buffer.
+        The file is not closed, logging continues in the same file. Use read_segment() to iterate without a list.
 
         Returns:
             A list of tuples representing the content of the file. Each tuple contains the unpacked data from a line in the file.
-
-        Raises:
-            FileNotFoundError: If the file does not exist.
         """
-        self.close()
-        if self.status == _CLOSED:
-            # TODO file not existing
-            with open(self.current_path, "rb") as file:
-                content = []
-                # TODO add max iter (max lines to read from file)
-                while True:
-                    cr = file.read(self.bytesize)
-                    if not cr:
-                        break
-                    content.append(struct.unpack(self.data_format, cr))
-                return content
-        else:
-            print("File is not closed!")
+        if not self.index:
+            return []
+        return list(self.read_segment())
 
 
 class ImageProcess(DataProcess):
-    def __init__(self, tag_name: str, home_path: str = "/sd"):
+    def __init__(self, tag_name: str, home_path: str = "/sd", exists: bool = False, cluster_size: int = 1):
 
         self.tag_name = tag_name
         self.file = None
+        self.persistent = True
+
+        # Raw bytes, no records
+        self.crc = False
+        self.record_size = 1
+        self.quantization = None
+        self.columnar = False
+
+        # Staging buffer, the image fragments are only written to the file in whole sectors
+        self.flush_bytes = _IMG_FLUSH_BYTES
+        self.write_buffer = bytearray(_IMG_FLUSH_BYTES)
+        self.buffered = 0
+        self.quota = None
+        self.retention_priority = _RETENTION_PRIORITY
+        self.last_values = None
 
         self.status = _CLOSED
 
         self.dir_path = home_path + "/" + self.tag_name + "/"
-        self.create_folder()
+        if not exists:
+            self.create_folder()
 
         self.size_limit = _IMG_SIZE_LIMIT
 
-        self.current_path = self.create_new_path()
-        self.delete_paths = []  # Paths that are flagged for deletion
-        self.excluded_paths = []  # Paths that are currently being transmitted
+        self.current_path = None
+
+        self.cluster_size = cluster_size
+        self.file_size = 0
+        self.load_index()
 
+        self.config_data = {_IMG_TAG_NAME: True}
         config_file_path = self.dir_path + _PROCESS_CONFIG_FILENAME
-        if not path_exist(config_file_path):
-            config_data = {_IMG_TAG_NAME: True}
+        if not exists and not path_exist(config_file_path):
             with open(config_file_path, "w") as config_file:
-                json.dump(config_data, config_file)
+                json.dump(self.config_data, config_file)
 
     def log(self, data: bytearray) -> None:
         """
         Logs the given image data.
+        The data is staged in RAM and written to the file flush_bytes at a time, the rest when the image is completed.
 
         Args:
             data (List[bytes]): The bytes of image data to be logged.
@@ -414,8 +1393,15 @@ class ImageProcess(DataProcess):
         self.resolve_current_file()
         self.last_data = data
 
-        self.file.write(data)
-        self.file.flush()
+        data = memoryview(data)
+        offset = 0
+        while offset < len(data):
+            size = min(len(data) - offset, self.flush_bytes - self.buffered)
+            self.write_buffer[self.buffered : self.buffered + size] = data[offset : offset + size]
+            self.buffered += size
+            offset += size
+            if self.buffered == self.flush_bytes:
+                self.flush()
 
     def request_TM_path(self, latest: bool = False) -> Optional[str]:
         """
@@ -426,34 +1412,22 @@ class ImageProcess(DataProcess):
 
         The function store the file path to be excluded in clean-up policies.
         Once fully transmitted, notify_TM_path() must be called to remove the file from the exclusion list.
-        """
-        # Assumes correct ordering (monotonic timestamp)
-        # TODO
-        files = os.listdir(self.dir_path)
-        if len(files) > 1:  # Ignore process configuration file
-
-            if latest:
-                transmit_file = files[-1]
-                if transmit_file == _PROCESS_CONFIG_FILENAME:
-                    transmit_file = files[-2]
-            else:
-                transmit_file = files[0]
-                if transmit_file == _PROCESS_CONFIG_FILENAME:
-                    transmit_file = files[1]
 
-            tm_path = self.dir_path + transmit_file
-
-            if tm_path == self.current_path or not path_exist(tm_path):
+        The image currently being written is never returned. An image being transmitted is returned again
+        until it is acknowledged.
+        """
+        i = self.next_segment(_SEG_EXCLUDED, latest)
+        if i is None:
+            i = self.next_segment(_SEG_CLOSED, latest)
+            if i is None:
                 return None
+            self.set_segment(i, self.segment_size(i), _SEG_EXCLUDED)
 
-            self.excluded_paths.append(tm_path)
-            return tm_path
-        else:
-            return None
+        return self.segment_path(self.segment_time(i))
 
     def image_completed(self):
         """
-        Closes the current file and resolves it, to prepare for the next image.
+        Writes the staged image data, closes the current file and resolves it, to prepare for the next image.
 
         Returns:
             None
@@ -461,6 +1435,22 @@ class ImageProcess(DataProcess):
         self.close()
         self.resolve_current_file()
 
+    def image_discarded(self):
+        """
+        Drops the image currently being received (e.g. a truncated transfer): the staged data is discarded and
+        the partial file deleted, so that it is never transmitted as a complete image.
+
+        Returns:
+            None
+        """
+        if self.status != _OPEN:
+            return
+        self.buffered = 0
+        self.close()
+        i = self.segment_count() - 1
+        self.set_segment(i, self.segment_size(i), _SEG_DELETE)
+        self.clean_up()
+
 
 class DataHandler:
     """
@@ -474,50 +1464,159 @@ class DataHandler:
     sd_path = "/sd"
     # Keep track of all file processes
     data_process_registry = dict()
+    # Bytes on the SD card outside of the data files of the registered processes (configuration files,
+    # segment indexes, unregistered directories), measured by reconcile_storage()
+    untracked_size = 0
+    # Maximum number of bytes stored on the SD card, enforced by enforce_quotas() (None for no limit).
+    # Derived from the SD card capacity by scan_SD_card() if not configured
+    total_quota = None
+    # Allocation unit of the SD card file system, read by scan_SD_card(). The quotas are enforced on the space
+    # allocated to the files, rounded up to whole clusters
+    cluster_size = 1
+    # Configuration of the persistent data processes by tag name, mirrored in the manifest file
+    manifest = dict()
 
     @classmethod
     def scan_SD_card(cls) -> None:
         """
         Scans the SD card for configuration files and registers data processes.
 
-        This method scans the SD card for directories and checks if each directory contains a configuration file.
+        The data processes listed in the manifest at the root of the SD card are registered directly, without
+        accessing their directories. If the manifest is missing or corrupt, this method scans the SD card for
+        directories and checks if each directory contains a configuration file.
         If a configuration file is found, it reads the data format and line limit from the file and registers
-        a data process with the specified parameters.
+        a data process with the specified parameters. The manifest is then rewritten.
 
         If an 'img' configuration is found, it registers an image process with the specified data format.
 
         Returns:
             None
 
+        The cluster size of the SD card is read, and the total quota is derived from its capacity if it is not
+        configured.
+
         Example:
             DataHandler.scan_SD_card()
         """
+        cls.set_cluster_size()
+        if cls.total_quota is None:
+            cls.set_total_quota()
+
+        manifest = cls.load_manifest()
+        if manifest is not None:
+            cls.manifest = manifest
+            try:
+                for tag_name, config_data in manifest.items():
+                    cls.register_from_config(tag_name, config_data, exists=True)
+                return
+            except OSError as e:
+                # TODO log
+                print(f"Manifest out of date ({e}), scanning the SD card.")
+
+        cls.manifest = {}
         directories = cls.list_directories()
         for dir_name in directories:
             config_file = join_path(cls.sd_path, dir_name, _PROCESS_CONFIG_FILENAME)
             if path_exist(config_file):
                 with open(config_file, "r") as f:
                     config_data = json.load(f)
-
-                    if _IMG_TAG_NAME in config_data:
-                        data_format: str = config_data.get(_IMG_TAG_NAME)
-                        cls.register_image_process()
-                        continue
-                    data_format: str = config_data.get("data_format")
-                    line_limit: int = config_data.get("line_limit")
-                    data_keys: List[str] = config_data.get("data_keys")
-                    if data_format and line_limit:
-                        cls.register_data_process(
-                            tag_name=dir_name,
-                            data_keys=data_keys,
-                            data_format=data_format,
-                            persistent=True,
-                            line_limit=line_limit,
-                        )
-                    print("HERE6")
+                cls.register_from_config(dir_name, config_data)
 
         # print("SD Card Scanning complete - found ", cls.data_process_registry.keys())
 
+    @classmethod
+    def set_cluster_size(cls) -> int:
+        """
+        Sets cluster_size to the allocation unit of the SD card file system, used by the data processes
+        registered afterwards. Unchanged if the SD card cannot be read.
+
+        Returns:
+            The cluster size in bytes.
+        """
+        try:
+            cls.cluster_size = os.statvfs(cls.sd_path)[1]  # Fragment size, a cluster on FAT
+        except OSError as e:
+            # TODO log
+            print(f"Could not read the SD card cluster size: {e}")
+        return cls.cluster_size
+
+    @classmethod
+    def set_total_quota(cls, percent: int = _TOTAL_QUOTA_PERCENT) -> Optional[int]:
+        """
+        Sets total_quota to the given share of the capacity of the SD card.
+
+        Args:
+            percent (int, optional): Share of the capacity in percent (default is 90).
+
+        Returns:
+            The total quota in bytes, or None if the capacity of the SD card could not be read.
+        """
+        try:
+            stats = os.statvfs(cls.sd_path)
+        except OSError as e:
+            # TODO log
+            print(f"Could not read the SD card capacity: {e}")
+            return None
+        # Fragment size times number of fragments
+        cls.total_quota = stats[1] * stats[2] * percent // 100
+        return cls.total_quota
+
+    @classmethod
+    def register_from_config(cls, tag_name: str, config_data: dict, exists: bool = False) -> None:
+        """
+        Registers a persistent data process (or the image process) from its configuration data.
+        """
+        if _IMG_TAG_NAME in config_data:
+            cls.register_image_process(exists=exists)
+            return
+        data_format: str = config_data.get("data_format")
+        line_limit: int = config_data.get("line_limit")
+        data_keys: List[str] = config_data.get("data_keys")
+        if data_format and line_limit:
+            cls.register_data_process(
+                tag_name=tag_name,
+                data_keys=data_keys,
+                data_format=data_format,
+                persistent=True,
+                line_limit=line_limit,
+                flush_bytes=config_data.get("flush_bytes", _FLUSH_BYTES),
+                flush_age=config_data.get("flush_age", _FLUSH_AGE),
+                quota=config_data.get("quota"),
+                retention_priority=config_data.get("retention_priority", _RETENTION_PRIORITY),
+                history_size=config_data.get("history_size", 0),
+                exists=exists,
+                crc=config_data.get("crc", False),
+                quantization=config_data.get("quantization"),
+                columnar=config_data.get("columnar", False),
+            )
+
+    @classmethod
+    def load_manifest(cls) -> Optional[dict]:
+        """
+        Reads the manifest at the root of the SD card.
+
+        Returns:
+            The configuration of the data processes by tag name, or None if the manifest is missing or corrupt.
+        """
+        try:
+            with open(join_path(cls.sd_path, _MANIFEST_FILENAME), "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(manifest, dict):
+            return None
+        return manifest
+
+    @classmethod
+    def update_manifest(cls, tag_name: str, config_data: dict) -> None:
+        """
+        Adds or updates the configuration of a data process in the manifest, only writing it if it changed.
+        """
+        if cls.manifest.get(tag_name) != config_data:
+            cls.manifest[tag_name] = config_data
+            with open(join_path(cls.sd_path, _MANIFEST_FILENAME), "w") as f:
+                json.dump(cls.manifest, f)
+
     @classmethod
     def register_data_process(
         cls,
@@ -526,6 +1625,15 @@ class DataHandler:
         data_format: str,
         persistent: bool,
         line_limit: int = 1000,
+        flush_bytes: int = _FLUSH_BYTES,
+        flush_age: int = _FLUSH_AGE,
+        quota: Optional[int] = None,
+        retention_priority: int = _RETENTION_PRIORITY,
+        history_size: int = 0,
+        exists: bool = False,
+        crc: bool = False,
+        quantization: Optional[dict] = None,
+        columnar: bool = False,
     ) -> None:
         """
         Register a data process with the given parameters.
@@ -536,6 +1644,17 @@ class DataHandler:
         - data_format (str): The format of the data.
         - persistent (bool): Whether the data should be logged to a file.
         - line_limit (int, optional): The maximum number of data lines to store. Defaults to 1000.
+        - flush_bytes (int, optional): Size of the buffered writes to the SD card. Defaults to 512.
+        - flush_age (int, optional): Maximum time in seconds data stays buffered in RAM. Defaults to 10.
+        - quota (int, optional): Maximum number of bytes stored on the SD card. Defaults to None (no limit).
+        - retention_priority (int, optional): Eviction order when the SD card is over quota, higher values are
+          evicted first. Defaults to 8.
+        - history_size (int, optional): Number of most recent records kept in RAM, see get_history(). Defaults to 0.
+        - exists (bool, optional): Whether the process files are known to exist on the SD card. Defaults to False.
+        - crc (bool, optional): Whether to frame each record with a sync marker and a CRC. Defaults to False.
+        - quantization (dict, optional): Scale factor of each float field, enables the compressed encoding of the
+          closed files. Defaults to None (no compression).
+        - columnar (bool, optional): Whether to store the records as blocks of per-field columns. Defaults to False.
 
         Raises:
         - ValueError: If line_limit is not a positive integer.
@@ -544,26 +1663,44 @@ class DataHandler:
         - None
         """
         if isinstance(line_limit, int) and line_limit > 0:
-            cls.data_process_registry[tag_name] = DataProcess(
+            process = DataProcess(
                 tag_name,
                 data_keys,
                 data_format,
                 persistent=persistent,
                 line_limit=line_limit,
                 home_path=cls.sd_path,
+                flush_bytes=flush_bytes,
+                flush_age=flush_age,
+                quota=quota,
+                retention_priority=retention_priority,
+                history_size=history_size,
+                exists=exists,
+                crc=crc,
+                quantization=quantization,
+                columnar=columnar,
+                cluster_size=cls.cluster_size,
             )
+            cls.data_process_registry[tag_name] = process
+            if persistent:
+                cls.update_manifest(tag_name, process.config_data)
         else:
             raise ValueError("Line limit must be a positive integer.")
 
     @classmethod
-    def register_image_process(cls) -> None:
+    def register_image_process(cls, exists: bool = False) -> None:
         """
         Register an image process with the given data format.
 
+        Parameters:
+        - exists (bool, optional): Whether the process files are known to exist on the SD card. Defaults to False.
+
         Returns:
         - None
         """
-        cls.data_process_registry[_IMG_TAG_NAME] = ImageProcess(_IMG_TAG_NAME)
+        process = ImageProcess(_IMG_TAG_NAME, home_path=cls.sd_path, exists=exists, cluster_size=cls.cluster_size)
+        cls.data_process_registry[_IMG_TAG_NAME] = process
+        cls.update_manifest(_IMG_TAG_NAME, process.config_data)
 
     @classmethod
     def log_data(cls, tag_name: str, data: dict) -> None:
@@ -588,6 +1725,33 @@ class DataHandler:
         except KeyError as e:
             print(f"Error: {e}")
 
+    @classmethod
+    def log_values(cls, tag_name: str, *values) -> None:
+        """
+        Logs a data point given as values in the order of the data keys of the process.
+        Allocation-free alternative to log_data() for tasks logging at high rate.
+
+        Parameters:
+        - tag_name (str): The name of data process to associate with the logged data.
+        - *values: The values to be logged.
+
+        Raises:
+        - KeyError: If the provided tag name is not registered in the data process registry.
+
+        Returns:
+        - None
+
+        Example:
+            DataHandler.log_values('imu', time.time(), ax, ay, az)
+        """
+        try:
+            if tag_name in cls.data_process_registry:
+                cls.data_process_registry[tag_name].log_values(*values)
+            else:
+                raise KeyError("Data process not registered!")
+        except KeyError as e:
+            print(f"Error: {e}")
+
     @classmethod
     def log_image(cls, data: List[bytes]) -> None:
         """
@@ -610,7 +1774,7 @@ class DataHandler:
     @classmethod
     def image_completed(cls) -> bool:
         """
-        Closes the current file and resolves it, to prepare for the next image.
+        Writes the staged image data, closes the current file and resolves it, to prepare for the next image.
 
         Returns:
             None
@@ -623,6 +1787,91 @@ class DataHandler:
         except KeyError as e:
             print(f"Error: {e}")
 
+    @classmethod
+    def image_discarded(cls) -> None:
+        """
+        Discards the image currently being received and deletes its partial file.
+
+        Returns:
+            None
+        """
+        try:
+            if _IMG_TAG_NAME in cls.data_process_registry:
+                cls.data_process_registry[_IMG_TAG_NAME].image_discarded()
+            else:
+                raise KeyError("Image data process not registered!")
+        except KeyError as e:
+            print(f"Error: {e}")
+
+    @classmethod
+    def flush_all(cls) -> None:
+        """
+        Writes the buffered data of all persistent data processes to the SD card.
+        Called on state transitions and before shutting down.
+        """
+        for process in cls.data_process_registry.values():
+            if process.persistent:
+                process.flush()
+
+    @classmethod
+    def query(cls, tag_name: str, t_start, t_end, fields: Optional[List[str]] = None):
+        """
+        Returns the records of the specified data process whose "time" value is between t_start and t_end (inclusive).
+
+        Parameters:
+        - tag_name (str): The name of the data process.
+        - t_start: Start of the time range.
+        - t_end: End of the time range.
+        - fields (List[str], optional): Keys of the values to return for each record. Defaults to all data keys.
+
+        Raises:
+        - KeyError: If the provided tag name is not registered in the data process registry.
+
+        Returns:
+        - An iterator over the matching records (tuples of values), read from the SD card as it is consumed.
+
+        Example:
+            for record in DataHandler.query('imu', t_pass_start, t_pass_end, fields=['time', 'gyro_x']):
+                ...
+        """
+        try:
+            if tag_name in cls.data_process_registry:
+                return cls.data_process_registry[tag_name].query(t_start, t_end, fields)
+            else:
+                raise KeyError("Data process not registered!")
+        except KeyError as e:
+            print(f"Error: {e}")
+            return iter(())
+
+    @classmethod
+    def get_history(cls, tag_name: str, n: Optional[int] = None, fields: Optional[List[str]] = None):
+        """
+        Returns the most recent records of the specified data process from its RAM history, oldest first.
+        The process must have been registered with a history_size.
+
+        Parameters:
+        - tag_name (str): The name of the data process.
+        - n (int, optional): Number of records. Defaults to the whole history.
+        - fields (List[str], optional): Keys of the values to return for each record. Defaults to all data keys.
+
+        Raises:
+        - KeyError: If the provided tag name is not registered in the data process registry.
+
+        Returns:
+        - An iterator over the records (tuples of values).
+
+        Example:
+            max_temp = max(value for value, in DataHandler.get_history('monitor', 10, fields=['temperature']))
+        """
+        try:
+            if tag_name in cls.data_process_registry:
+                return cls.data_process_registry[tag_name].get_history(n, fields)
+            else:
+                raise KeyError("Data process not registered!")
+        except KeyError as e:
+            print(f"Error: {e}")
+            return iter(())
+
     @classmethod
     def get_latest_data(cls, tag_name: str):
         """
@@ -706,9 +1955,9 @@ class DataHandler:
         return list(cls.data_process_registry.values())
 
     @classmethod
-    def get_storage_info(cls, tag_name: str) -> None:
+    def get_storage_info(cls, tag_name: str) -> Optional[Tuple[int, int]]:
         """
-        Prints the storage information for the specified data process.
+        Returns the storage information for the specified data process.
 
         Parameters:
             tag_name (str): The name of the data process.
@@ -717,19 +1966,150 @@ class DataHandler:
             KeyError: If the provided tag name is not registered in the data process registry.
 
         Returns:
-            None
+            A tuple containing the number of files and their total size in bytes.
 
         Example:
             DataHandler.get_storage_info('tag_name')
         """
         try:
             if tag_name in cls.data_process_registry:
-                cls.data_process_registry[tag_name].get_storage_info()
+                return cls.data_process_registry[tag_name].get_storage_info()
             else:
                 raise KeyError("File process not registered.")
         except KeyError as e:
             print(f"Error: {e}")
 
+    @classmethod
+    def get_total_storage_info(cls) -> Tuple[int, int]:
+        """
+        Returns the number of data files and the total size in bytes of the SD card content.
+
+        Computed from the in-memory counters of the data processes, without accessing the SD card.
+        Files outside of the data processes are included once reconcile_storage() has been called.
+
+        Returns:
+            A tuple containing the number of data files and the total size in bytes.
+
+        Example:
+            DataHandler.get_total_storage_info()
+        """
+        file_count = 0
+        total_size = cls.untracked_size
+        for process in cls.data_process_registry.values():
+            if process.persistent:
+                process_files, process_size = process.get_storage_info()
+                file_count += process_files
+                total_size += process_size
+        return file_count, total_size
+
+    @classmethod
+    def get_total_allocated_size(cls) -> int:
+        """
+        Returns the space taken on the SD card, with the files of the data processes rounded up to whole clusters.
+        Computed from the in-memory counters like get_total_storage_info().
+        """
+        total_size = cls.untracked_size
+        for process in cls.data_process_registry.values():
+            if process.persistent:
+                total_size += process.get_allocated_size()
+        return total_size
+
+    @classmethod
+    def reconcile_storage(cls) -> Tuple[int, int]:
+        """
+        Walks the whole SD card to resynchronize the storage counters of every data process with the files
+        actually stored, and measures the size of the files that do not belong to any data process.
+        Expensive, only meant to be called at boot or on demand.
+
+        Returns:
+            A tuple containing the number of data files and the total size in bytes (see get_total_storage_info()).
+        """
+        for tag_name, process in cls.data_process_registry.items():
+            if process.persistent:
+                file_count, total_size = process.scan_storage()
+                if (file_count, total_size) != (process.file_count, process.total_size):
+                    # TODO log
+                    print(f"Storage counters of {tag_name} out of sync, {process.total_size} bytes instead of {total_size}.")
+                    process.file_count = file_count
+                    process.total_size = total_size
+                process.allocated_size = process.compute_allocated_size()
+
+        cls.untracked_size = 0
+        tracked_files, tracked_size = cls.get_total_storage_info()
+        # Buffered data is counted by the processes but is not on the SD card yet
+        for process in cls.data_process_registry.values():
+            if process.persistent:
+                tracked_size -= process.buffered
+        cls.untracked_size = cls.compute_total_size_files() - tracked_size
+        return cls.get_total_storage_info()
+
+    @classmethod
+    def enforce_quotas(cls, max_evictions: int = _MAX_EVICTIONS) -> int:
+        """
+        Evicts the oldest files of the data processes exceeding their quota, then, while the SD card exceeds
+        total_quota, the oldest file of the process with the highest retention_priority value.
+        Files being transmitted are never evicted. Usage is measured in whole clusters (see get_allocated_size()).
+
+        At most max_evictions files are deleted per call so that the work is spread over successive calls.
+
+        Returns:
+            The number of evicted files.
+        """
+        evictions = 0
+        freed = 0
+        evicted_processes = []
+
+        for process in cls.data_process_registry.values():
+            if not process.persistent or process.quota is None:
+                continue
+            usage = process.get_allocated_size()
+            while usage > process.quota and evictions < max_evictions:
+                size = process.evict_oldest()
+                if size is None:
+                    break
+                usage -= process.allocation(size)
+                freed += process.allocation(size)
+                evictions += 1
+                if process not in evicted_processes:
+                    evicted_processes.append(process)
+
+        if cls.total_quota is not None:
+            # Flagged files are only removed from the counters by clean_up()
+            usage = cls.get_total_allocated_size() - freed
+            while usage > cls.total_quota and evictions < max_evictions:
+                process = cls.eviction_candidate()
+                if process is None:
+                    break
+                usage -= process.allocation(process.evict_oldest())
+                evictions += 1
+                if process not in evicted_processes:
+                    evicted_processes.append(process)
+
+        for process in evicted_processes:
+            process.clean_up()
+
+        return evictions
+
+    @classmethod
+    def eviction_candidate(cls) -> Optional[DataProcess]:
+        """
+        Returns the data process to evict a file from when the SD card is over quota: the process with the highest
+        retention_priority value, and among those the one with the oldest evictable file.
+        """
+        candidate = None
+        candidate_key = None
+        for process in cls.data_process_registry.values():
+            if not process.persistent:
+                continue
+            i = process.next_segment(_SEG_CLOSED)
+            if i is None:
+                continue
+            key = (-process.retention_priority, process.segment_time(i))
+            if candidate_key is None or key < candidate_key:
+                candidate = process
+                candidate_key = key
+        return candidate
+
     @classmethod
     def data_process_exists(cls, tag_name: str) -> bool:
         """
@@ -803,6 +2183,7 @@ class DataHandler:
     def delete_all_files(cls, path=None):
         if path is None:
             path = cls.sd_path
+            cls.manifest = {}
         try:
             for file_name in os.listdir(path):
                 file_path = path + "/" + file_name
@@ -828,7 +2209,8 @@ class DataHandler:
     @classmethod
     def compute_total_size_files(cls, root_path: str = None) -> int:
         """
-        Computes the total size of all files under the sd_path.
+        Computes the total size of all files under the sd_path by walking the directories.
+        Prefer get_total_storage_info(), which does not access the SD card.
 
         Returns:
         - The total size in bytes.
@@ -838,13 +2220,13 @@ class DataHandler:
         total_size: int = 0
         for entry in os.listdir(root_path):
             file_path: str = join_path(root_path, entry)
-            if os.stat(file_path)[0] & 0x4000:  # Check if entry is a directory
+            stats = os.stat(file_path)
+            if stats[0] & 0x4000:  # Check if entry is a directory
                 total_size += cls.compute_total_size_files(
                     file_path
                 )  # Recursively compute total size of files in subdirectories
             else:
-                total_size += os.stat(file_path)[6]
-            pass
+                total_size += stats[6]
         return total_size
 
     # DEBUG ONLY
@@ -919,3 +2301,30 @@ def join_path(*paths: str) -> str:
     if not paths[0].startswith("/"):
         normalized_path = normalized_path.lstrip("/")
     return normalized_path
+
+
+def _quantize(value: float, scale: int) -> int:
+    """
+    Converts a float value to the fixed-point value of the compressed encoding. Infinities and NaN are encoded with
+    reserved values, finite values are rounded to the nearest multiple of 1/scale whatever their magnitude.
+    """
+    if value != value:
+        return _QUANT_NAN
+    if value == _INF:
+        return _QUANT_INF
+    if value == -_INF:
+        return -_QUANT_INF
+    return round(value * scale)
+
+
+def _dequantize(q: int, scale: int) -> float:
+    """
+    Converts a fixed-point value of the compressed encoding back to a float, see _quantize().
+    """
+    if -_QUANT_INF < q < _QUANT_INF:
+        return q / scale
+    if q == _QUANT_INF:
+        return _INF
+    if q == -_QUANT_INF:
+        return -_INF
+    return _NAN
@@ -1,6 +1,15 @@
-from core.scheduler.loop import Loop
+from core.scheduler.events import Channel, Event, Queue, QueueEmpty, QueueFull  # noqa: F401
+from core.scheduler.loop import (  # noqa: F401
+    OVERRUN_HALVE_RATE,
+    OVERRUN_LOG,
+    OVERRUN_SKIP,
+    Loop,
+    VirtualClock,
+    use_virtual_clock,
+)
 
 __global_event_loop = None
+__channels = {}
 
 
 def get_loop(debug=False):
@@ -11,6 +20,15 @@ def get_loop(debug=False):
     return __global_event_loop
 
 
+def get_channel(name):
+    """Returns the named publish/subscribe channel shared by producer and consumer tasks, created on first use"""
+    channel = __channels.get(name)
+    if channel is None:
+        channel = Channel(get_loop())
+        __channels[name] = channel
+    return channel
+
+
 def enable_debug_logging():
     get_loop().enable_debug_logging()
 
@@ -20,5 +38,7 @@ run_later = get_loop().run_later
 schedule = get_loop().schedule
 schedule_later = get_loop().schedule_later
 sleep = get_loop().sleep
+wait_for = get_loop().wait_for
+time_nanos = get_loop().time_nanos
 suspend = get_loop().suspend
 run = get_loop().run
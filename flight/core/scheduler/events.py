@@ -0,0 +1,168 @@
+"""
+Inter-task synchronization primitives for the scheduler loop.
+
+Tasks await these instead of polling shared state on every run: a suspended consumer
+is not part of the loop's ready queues and only wakes up when a producer sets,
+puts or publishes.
+"""
+
+
+def _default_loop(loop):
+    if loop is None:
+        from core.scheduler import get_loop
+
+        loop = get_loop()
+    return loop
+
+
+class QueueEmpty(Exception):
+    """Raised by Queue.get_nowait() when the queue is empty."""
+
+    pass
+
+
+class QueueFull(Exception):
+    """Raised by Queue.put_nowait() when the queue is full."""
+
+    pass
+
+
+class Event:
+    """
+    Flag that tasks can wait on.
+
+    Use:
+      data_ready = Event()
+      # Consumer
+      await data_ready.wait()
+      # Producer
+      data_ready.set()
+    """
+
+    def __init__(self, loop=None):
+        self._loop = _default_loop(loop)
+        self._set = False
+        self._waiters = []
+
+    def is_set(self):
+        return self._set
+
+    def set(self):
+        """Sets the flag and resumes every waiting task"""
+        self._set = True
+        for resume in self._waiters:
+            resume()
+        self._waiters.clear()
+
+    def clear(self):
+        self._set = False
+
+    async def wait(self):
+        """From within a coroutine, waits until the flag is set (returns immediately if it already is)"""
+        if self._set:
+            return
+        suspender, resume = self._loop.suspend()
+        self._waiters.append(resume)
+        await suspender
+
+
+class Queue:
+    """
+    Bounded FIFO queue backed by a fixed-size ring buffer.
+
+    get() suspends the calling task while the queue is empty and put() while it is full.
+    The *_nowait variants never suspend and raise QueueEmpty / QueueFull instead.
+    """
+
+    def __init__(self, maxsize=8, loop=None):
+        if maxsize < 1:
+            raise ValueError("Queue size must be a positive integer.")
+        self._loop = _default_loop(loop)
+        self._items = [None] * maxsize
+        self._head = 0
+        self._count = 0
+        self._getters = []
+        self._putters = []
+
+    @property
+    def maxsize(self):
+        return len(self._items)
+
+    def qsize(self):
+        return self._count
+
+    def empty(self):
+        return self._count == 0
+
+    def full(self):
+        return self._count == len(self._items)
+
+    def put_nowait(self, item):
+        if self._count == len(self._items):
+            raise QueueFull("Queue is full.")
+        self._items[(self._head + self._count) % len(self._items)] = item
+        self._count += 1
+        if self._getters:
+            self._getters.pop(0)()
+
+    def get_nowait(self):
+        if self._count == 0:
+            raise QueueEmpty("Queue is empty.")
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % len(self._items)
+        self._count -= 1
+        if self._putters:
+            self._putters.pop(0)()
+        return item
+
+    async def put(self, item):
+        """From within a coroutine, adds an item, waiting for a free slot if the queue is full"""
+        while self._count == len(self._items):
+            suspender, resume = self._loop.suspend()
+            self._putters.append(resume)
+            await suspender
+        self.put_nowait(item)
+
+    async def get(self):
+        """From within a coroutine, removes and returns the oldest item, waiting for one if the queue is empty"""
+        while self._count == 0:
+            suspender, resume = self._loop.suspend()
+            self._getters.append(resume)
+            await suspender
+        return self.get_nowait()
+
+
+class Channel:
+    """
+    Publish/subscribe channel.
+
+    Each subscriber gets its own bounded Queue. Publishing never blocks the producer:
+    when a subscriber's queue is full, its oldest value is dropped. The last published
+    value is also kept for consumers that only need the latest sample.
+
+    Use:
+      imu_samples = scheduler.get_channel("imu").subscribe()
+      sample = await imu_samples.get()
+    """
+
+    def __init__(self, loop=None):
+        self._loop = _default_loop(loop)
+        self._subscribers = []
+        self.last = None
+
+    def subscribe(self, maxsize=1):
+        queue = Queue(maxsize, self._loop)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def publish(self, value):
+        self.last = value
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(value)
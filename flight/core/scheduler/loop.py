@@ -1,33 +1,136 @@
 import time
 
 _monotonic_ns = time.monotonic_ns
+_idle_until_nanos = None
 
 
-def set_time_provider(monotonic_ns):
-    global _monotonic_ns
+def set_time_provider(monotonic_ns, idle_until_nanos=None):
+    """
+    Replaces the clock used by the scheduler.
+
+    :param monotonic_ns: Function returning the current time in integer nanoseconds.
+    :param idle_until_nanos: Optional function called with the next wake-up time instead of
+        time.sleep() when the loop has nothing to run. A virtual clock uses it to jump forward.
+    """
+    global _monotonic_ns, _idle_until_nanos
     _monotonic_ns = monotonic_ns
+    _idle_until_nanos = idle_until_nanos
+
+
+class VirtualClock:
+    """
+    Simulated monotonic clock for deterministic discrete-event runs on the host.
+
+    Whenever the loop idles, the clock jumps straight to the next sleeper's wake-up time
+    instead of waiting, so hours of schedule run in seconds. Time only moves while idling
+    (or through advance()), which makes task execution instantaneous in virtual time.
+    """
+
+    def __init__(self, start_nanos=0, epoch=0):
+        self.nanos = start_nanos
+        self.epoch = epoch
+
+    def monotonic_ns(self):
+        return self.nanos
+
+    def time(self):
+        """Wall-clock seconds matching time.time(), offset by epoch. Host harnesses can install it as time.time"""
+        return self.epoch + self.nanos // 1000000000
+
+    def advance_to(self, nanos):
+        if nanos > self.nanos:
+            self.nanos = nanos
+
+    def advance(self, seconds):
+        self.nanos += int(seconds * 1000000000)
+
+
+def use_virtual_clock(clock=None):
+    """Switches the scheduler to a VirtualClock (a new one if none is given) and returns it"""
+    if clock is None:
+        clock = VirtualClock()
+    set_time_provider(clock.monotonic_ns, clock.advance_to)
+    return clock
+
+
+class _CallMeNextTime:
+    def __await__(self):
+        # This is inside the scheduler where we know generator yield is the
+        #   implementation of task switching in CircuitPython.  This throws
+        #   control back out through user code and up to the scheduler's
+        #   __iter__ stack which will see that we've suspended _current.
+        # Don't yield in async methods; only await unless you're making a library.
+        yield
+
+
+# The awaitable is stateless, so a single instance is shared by every task instead of
+# allocating a new one (and a new class) each time a task yields.
+_YIELD = _CallMeNextTime()
 
 
 def _yield_once():
     """await the return value of this function to yield the processor"""
+    return _YIELD
 
-    class _CallMeNextTime:
-        def __await__(self):
-            # This is inside the scheduler where we know generator yield is the
-            #   implementation of task switching in CircuitPython.  This throws
-            #   control back out through user code and up to the scheduler's
-            #   __iter__ stack which will see that we've suspended _current.
-            # Don't yield in async methods; only await unless you're making a library.
-            yield
 
-    return _CallMeNextTime()
+def _hz_to_nanos(hz):
+    """Converts a rate to an integer period in nanoseconds (computed once, not per tick)"""
+    return int(1000000000 / hz)
 
 
 def _get_future_nanos(seconds_in_future):
     return _monotonic_ns() + int(seconds_in_future * 1000000000)
 
 
+# Binary min-heap helpers for the sleeping queue (heapq is not available on all CircuitPython builds).
+# Sleepers are ordered by wake-up time first, then by task priority.
+
+
+def _sleeper_before(a, b):
+    if a._resume_nanos != b._resume_nanos:
+        return a._resume_nanos < b._resume_nanos
+    return a.task.priority < b.task.priority
+
+
+def _heap_push(heap, item):
+    heap.append(item)
+    pos = len(heap) - 1
+    while pos > 0:
+        parent = (pos - 1) >> 1
+        if not _sleeper_before(item, heap[parent]):
+            break
+        heap[pos] = heap[parent]
+        pos = parent
+    heap[pos] = item
+
+
+def _heap_pop(heap):
+    last = heap.pop()
+    if not heap:
+        return last
+    top = heap[0]
+    size = len(heap)
+    pos = 0
+    child = 1
+    while child < size:
+        right = child + 1
+        if right < size and _sleeper_before(heap[right], heap[child]):
+            child = right
+        if not _sleeper_before(heap[child], last):
+            break
+        heap[pos] = heap[child]
+        pos = child
+        child = 2 * pos + 1
+    heap[pos] = last
+    return top
+
+
 class Sleeper:
+    """
+    Entry of the sleeping heap. ScheduledTasks own a single Sleeper that is re-armed
+    for every period, so steady-state sleeping does not allocate.
+    """
+
     def __init__(self, resume_nanos, task):
         self.task = task
         self._resume_nanos = resume_nanos
@@ -50,6 +153,8 @@ class PriorityTask:
     def __init__(self, coroutine, priority):
         self.coroutine = coroutine
         self.priority = priority
+        # Time spent running this task (not suspended), accumulated by Loop._run_task
+        self.run_nanos = 0
 
     def priority_sort(self):
         return self.priority
@@ -60,6 +165,72 @@ class PriorityTask:
     __str__ = __repr__
 
 
+# What a ScheduledTask does when an iteration takes longer than its budget
+OVERRUN_LOG = 0  # Report the overrun and keep running at the same rate
+OVERRUN_SKIP = 1  # Skip the next run
+OVERRUN_HALVE_RATE = 2  # Halve the task rate, restored one step per run within budget
+
+# A task slowed down by OVERRUN_HALVE_RATE never runs at less than 1/_MAX_SLOWDOWN of its configured rate
+_MAX_SLOWDOWN = 8
+
+
+class TaskMetrics:
+    """
+    Runtime statistics of a ScheduledTask. All durations are integer nanoseconds.
+
+    The duration of an iteration is the time the loop spent running it, not counting the
+    time it was suspended (sleeping or waiting) while other tasks ran.
+
+    jitter is how late an iteration started with respect to its target_run_nanos and
+    overruns counts how often the task fell behind its schedule (i.e. an iteration
+    finished after the next one was due). budget_overruns counts the iterations that
+    took longer than the task budget, if any.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.run_count = 0
+        self.last_duration = 0
+        self.max_duration = 0
+        self.total_duration = 0
+        self.last_jitter = 0
+        self.max_jitter = 0
+        self.overruns = 0
+        self.budget_overruns = 0
+
+    @property
+    def mean_duration(self):
+        if self.run_count == 0:
+            return 0
+        return self.total_duration // self.run_count
+
+    def record_run(self, start_nanos, duration, target_run_nanos):
+        jitter = start_nanos - target_run_nanos
+        self.run_count += 1
+        self.last_duration = duration
+        self.total_duration += duration
+        if duration > self.max_duration:
+            self.max_duration = duration
+        self.last_jitter = jitter
+        if jitter > self.max_jitter:
+            self.max_jitter = jitter
+
+    def __repr__(self):
+        return "{{TaskMetrics runs: {}, last: {}ns, max: {}ns, mean: {}ns, max jitter: {}ns, overruns: {}, budget overruns: {}}}".format(
+            self.run_count,
+            self.last_duration,
+            self.max_duration,
+            self.mean_duration,
+            self.max_jitter,
+            self.overruns,
+            self.budget_overruns,
+        )
+
+    __str__ = __repr__
+
+
 class ScheduledTask:
     """Manages tasks that should run at a fixed rate."""
 
@@ -76,15 +247,81 @@ class ScheduledTask:
         self._forward_async_fn = forward_async_fn
         self._forward_args = forward_args
         self._forward_kwargs = forward_kwargs
-        self._nanoseconds_per_invocation = (1 / hz) * 1000000000
+        self._nanoseconds_per_invocation = _hz_to_nanos(hz)
+        self._base_nanos_per_invocation = self._nanoseconds_per_invocation
         self._stop = False
         self._running = False
         self._scheduled_to_run = False
         self._priority = priority
+        self._sleeper = Sleeper(0, None)
+        self.metrics = TaskMetrics()
+        self._budget_nanos = 0
+        self._overrun_policy = OVERRUN_LOG
+        self._phase_nanos = 0
+        self._origin_nanos = None
 
     def change_rate(self, hz):
         # Update the task rate to a new frequency ###
-        self._nanoseconds_per_invocation = (1 / hz) * 1000000000
+        self._nanoseconds_per_invocation = _hz_to_nanos(hz)
+        self._base_nanos_per_invocation = self._nanoseconds_per_invocation
+
+    def set_budget(self, budget_ms, overrun_policy=OVERRUN_LOG):
+        """
+        Sets the maximum execution time of a single run and what to do when it is exceeded.
+        Tasks are not preempted, the policy is applied once the overrunning iteration completes.
+
+        :param budget_ms: Budget in milliseconds, 0 or None to disable it.
+        :param overrun_policy: OVERRUN_LOG, OVERRUN_SKIP or OVERRUN_HALVE_RATE
+        """
+        if overrun_policy not in (OVERRUN_LOG, OVERRUN_SKIP, OVERRUN_HALVE_RATE):
+            raise ValueError("Unknown overrun policy {}".format(overrun_policy))
+        self._budget_nanos = int(budget_ms * 1000000) if budget_ms else 0
+        self._overrun_policy = overrun_policy
+
+    def change_priority(self, priority):
+        """Updates the task priority, applied from its next run"""
+        if not 0 <= priority < len(self._loop._ready_queues):
+            raise ValueError("Priority must be between 0 and {}".format(len(self._loop._ready_queues) - 1))
+        self._priority = priority
+
+    def set_phase(self, phase_seconds, origin_nanos=None):
+        """
+        Offsets the runs of the task by phase_seconds. Used to spread tasks of the same rate over their period.
+
+        Without an origin, the first run is delayed by phase_seconds after the task is started, which offsets
+        all its following runs by the same amount. It must then be set before the loop first steps the task
+        (e.g. right after Loop.schedule).
+        With an origin (a scheduler time shared by the tasks to stagger), the task is released at
+        origin + phase + k * period, whenever it was started. A running task moves to the new phase
+        after its next run.
+        """
+        self._phase_nanos = int(phase_seconds * 1000000000)
+        self._origin_nanos = origin_nanos
+
+    def _next_release(self, nanos):
+        """Returns the first release time at or after nanos on the grid given by the origin, phase and period"""
+        anchor = self._origin_nanos + self._phase_nanos
+        if nanos <= anchor:
+            return anchor
+        period = self._nanoseconds_per_invocation
+        return anchor + (nanos - anchor + period - 1) // period * period
+
+    def _handle_overrun(self):
+        """Applies the overrun policy, returns the extra delay in nanoseconds before the next run"""
+        self.metrics.budget_overruns += 1
+        delay_nanos = 0
+        if self._overrun_policy == OVERRUN_SKIP:
+            delay_nanos = self._nanoseconds_per_invocation
+        elif self._overrun_policy == OVERRUN_HALVE_RATE:
+            self._nanoseconds_per_invocation = min(
+                self._nanoseconds_per_invocation * 2, self._base_nanos_per_invocation * _MAX_SLOWDOWN
+            )
+        print(
+            "[SCHEDULER] {} took {}us, budget is {}us".format(
+                self._forward_async_fn, self.metrics.last_duration // 1000, self._budget_nanos // 1000
+            )
+        )
+        return delay_nanos
 
     def stop(self):
         # Stop the task (does not interrupt a currently running task) ###
@@ -101,32 +338,60 @@ class ScheduledTask:
     async def _run_at_fixed_rate(self):
         self._scheduled_to_run = True
         try:
-            target_run_nanos = _monotonic_ns()
+            now_nanos = _monotonic_ns()
+            if self._origin_nanos is not None:
+                target_run_nanos = self._next_release(now_nanos)
+            else:
+                target_run_nanos = now_nanos + self._phase_nanos
+            if target_run_nanos > now_nanos:
+                await self._loop._sleep_until_nanos(target_run_nanos, self._sleeper)
             while True:
                 if self._stop:
                     return  # Check before running
 
-                iteration = self._forward_async_fn(*self._forward_args, **self._forward_kwargs)
+                # This coroutine is the loop's current task, apply a priority change before it is re-queued
+                self._loop._current.priority = self._priority
+
+                if self._forward_args or self._forward_kwargs:
+                    iteration = self._forward_async_fn(*self._forward_args, **self._forward_kwargs)
+                else:
+                    iteration = self._forward_async_fn()
 
                 self._running = True
+                start_nanos = _monotonic_ns()
+                start_run_nanos = self._loop._current_run_nanos()
                 try:
                     await iteration
                 finally:
                     self._running = False
+                    self.metrics.record_run(start_nanos, self._loop._current_run_nanos() - start_run_nanos, target_run_nanos)
 
                 if self._stop:
                     return  # Check before waiting
 
+                if self._budget_nanos:
+                    if self.metrics.last_duration > self._budget_nanos:
+                        target_run_nanos += self._handle_overrun()
+                    elif self._nanoseconds_per_invocation > self._base_nanos_per_invocation:
+                        # Within budget again, recover the rate halved by previous overruns
+                        self._nanoseconds_per_invocation = max(
+                            self._nanoseconds_per_invocation // 2, self._base_nanos_per_invocation
+                        )
+
                 # Try to reschedule for the next window without skew. If we're falling behind,
                 # just go as fast as possible & schedule to run "now." If we catch back up again
                 # we'll return to seconds_per_invocation without doing a bunch of catchup runs.
-                target_run_nanos = target_run_nanos + self._nanoseconds_per_invocation
+                if self._origin_nanos is None:
+                    target_run_nanos = target_run_nanos + self._nanoseconds_per_invocation
+                else:
+                    target_run_nanos = self._next_release(target_run_nanos + 1)
                 # print('target_run_nanos is ', target_run_nanos)
                 now_nanos = _monotonic_ns()
                 if now_nanos <= target_run_nanos:
                     # print("Going to put to sleep")
-                    await self._loop._sleep_until_nanos(target_run_nanos)
+                    await self._loop._sleep_until_nanos(target_run_nanos, self._sleeper)
                 else:
+                    self.metrics.overruns += 1
                     target_run_nanos = now_nanos
                     # Allow other tasks a chance to run if this task is too slow.
                     await _yield_once()
@@ -134,23 +399,31 @@ class ScheduledTask:
             self._scheduled_to_run = False
 
     def __repr__(self):
-        hz = 1 / (self._nanoseconds_per_invocation / 1000000000)
+        hz = 1000000000 / self._nanoseconds_per_invocation
         state = "running" if self._running else "waiting"
         return "{{ScheduledTask {} rate: {}hz, fn: {}}}".format(state, hz, self._forward_async_fn)
 
     __str__ = __repr__
 
 
+# Number of task priorities supported by the loop (0 is the highest priority)
+PRIORITY_LEVELS = 16
+
+
 class Loop:
     """
     Core event loop class.  With run(), it manages your main application loop.
     """
 
-    def __init__(self, debug=False):
-        self._tasks = []
-        self._sleeping = []
-        self._ready = []
+    def __init__(self, debug=False, priority_levels=PRIORITY_LEVELS):
+        # Ready tasks, one FIFO per priority level. Tasks re-queued while a level is being
+        # drained go to its spare list so they run on the next step, not the current one.
+        self._ready_queues = [[] for _ in range(priority_levels)]
+        self._spare_queues = [[] for _ in range(priority_levels)]
+        self._ready_count = 0
+        self._sleeping = []  # Binary heap of Sleepers, see _heap_push/_heap_pop
         self._current = None
+        self._current_start_nanos = 0  # When the current task was last resumed
         self._debug = debug
 
     @property
@@ -170,8 +443,14 @@ class Loop:
         """
         if self._debug:
             print("adding task ", awaitable_task)
+        if not 0 <= priority < len(self._ready_queues):
+            raise ValueError("Priority must be between 0 and {}".format(len(self._ready_queues) - 1))
         # Added a priority parameter
-        self._tasks.append(PriorityTask(awaitable_task, priority))
+        self._enqueue(PriorityTask(awaitable_task, priority))
+
+    def _enqueue(self, task):
+        self._ready_queues[task.priority].append(task)
+        self._ready_count += 1
 
     async def sleep(self, seconds):
         """
@@ -183,6 +462,42 @@ class Loop:
         """
         await self._sleep_until_nanos(_get_future_nanos(seconds))
 
+    async def wait_for(self, predicate, timeout=None, poll_hz=100):
+        """
+        From within a coroutine, waits until predicate() returns a truthy value, polling it
+        poll_hz times per second. Other tasks keep running between polls.
+
+        Use:
+          if await loop.wait_for(radio.rx_done, timeout=1):
+              packet = radio.receive(timeout=0)
+
+        NOTE:  Always `await` this!
+
+        :param predicate: Function without arguments, e.g. a driver's data ready check.
+        :param timeout: Seconds after which to give up, or None to wait forever.
+        :param poll_hz: How many times per second the predicate is checked.
+        :returns: True if the predicate became true, False on timeout.
+        """
+        if predicate():
+            return True
+        poll_nanos = _hz_to_nanos(poll_hz)
+        deadline_nanos = None if timeout is None else _get_future_nanos(timeout)
+        # A single Sleeper is re-armed for every poll
+        sleeper = Sleeper(0, None)
+        while True:
+            next_poll_nanos = _monotonic_ns() + poll_nanos
+            if deadline_nanos is not None and next_poll_nanos > deadline_nanos:
+                next_poll_nanos = deadline_nanos
+            await self._sleep_until_nanos(next_poll_nanos, sleeper)
+            if predicate():
+                return True
+            if deadline_nanos is not None and _monotonic_ns() >= deadline_nanos:
+                return False
+
+    def time_nanos(self):
+        """Returns the current time of the scheduler clock in integer nanoseconds"""
+        return _monotonic_ns()
+
     def run_later(self, seconds_to_delay, awaitable_task, priority):
         """
         Add a concurrent task, delayed by some seconds.
@@ -215,7 +530,7 @@ class Loop:
         suspended = self._current
 
         def resume():
-            self._tasks.append(suspended)
+            self._enqueue(suspended)
 
         self._current = None
         return _yield_once(), resume
@@ -264,7 +579,7 @@ class Loop:
 
         return self.schedule(hz, call_later, priority)
 
-    def run(self):
+    def run(self, until_nanos=None):
         """
         Use:
             async def application_loop():
@@ -279,61 +594,63 @@ class Loop:
               run()
         The crucial StopIteration exception signifies the end of a coroutine in CircuitPython.
         Other Exceptions that reach the runner break out, stopping your app and showing a stack trace.
+
+        :param until_nanos: Optional time (as given by the time provider) at which the loop returns
+            even if tasks are still alive. Mostly useful with a VirtualClock.
         """
 
         assert self._current is None, "Loop can only be advanced by 1 stack frame at a time."
         self._loopnum = 0
-        while self._tasks or self._sleeping:
+        while self._ready_count or self._sleeping:
+            if until_nanos is not None and _monotonic_ns() >= until_nanos:
+                break
             if self._debug:
-                print("[{}] ---- sleeping: {}, active: {}\n".format(self._loopnum, len(self._sleeping), len(self._tasks)))
+                print("[{}] ---- sleeping: {}, active: {}\n".format(self._loopnum, len(self._sleeping), self._ready_count))
             self._step()
             self._loopnum += 1
         if self._debug:
-            print("Loop completed", self._tasks, self._sleeping)
+            print("Loop completed", self._ready_queues, self._sleeping)
 
     def _step(self):
         if self._debug:
-            print("  stepping over ", len(self._tasks), " tasks")
-
-        # Sort tasks by priority
-        self._tasks.sort(key=PriorityTask.priority_sort)
-
-        for _ in range(len(self._tasks)):
-            task = self._tasks.pop(0)
-            self._run_task(task)
-
-        if self._debug:
-            print("  sleeping list (unsorted):")
+            print("  sleeping heap:")
             for i in self._sleeping:
                 print("    {}".format(i))
 
-        # Create the ready list based on whichever tasks are ready to be executed
-        self._ready = [x for x in self._sleeping if x.resume_nanos() <= _monotonic_ns()]
-        # Sort the ready tasks based on priority
-        self._ready.sort(key=lambda x: x.task.priority)
+        # Move every sleeper that is due to its ready queue. The heap keeps the earliest
+        # wake-up on top, so this stops at the first sleeper that still has to wait.
+        now_nanos = _monotonic_ns()
+        while self._sleeping and self._sleeping[0]._resume_nanos <= now_nanos:
+            self._enqueue(_heap_pop(self._sleeping).task)
 
         if self._debug:
-            print("  ready list (sorted)")
-            for i in self._ready:
-                print("    {}".format(i))
-
-        # Run the ready tasks, and simultaneously remove them from the _sleeping and _ready lists
-        for i in range(len(self._ready)):
-            ready_task = self._ready.pop(0)
-            self._sleeping.remove(ready_task)
-            self._run_task(ready_task.task)
-
-        if len(self._tasks) == 0 and len(self._sleeping) > 0:
-
-            # Sort the sleeper list only when we need to, i.e, only
-            # when there are no active tasks, and the system needs to
-            # ACTUALLY sleep.
-
-            self._sleeping.sort(key=Sleeper.resume_nanos)
+            print("  stepping over ", self._ready_count, " tasks")
+
+        # Drain the ready queues from the highest to the lowest priority
+        ready_queues = self._ready_queues
+        for priority in range(len(ready_queues)):
+            queue = ready_queues[priority]
+            if not queue:
+                continue
+            ready_queues[priority] = self._spare_queues[priority]
+            self._ready_count -= len(queue)
+            for task in queue:
+                self._run_task(task)
+            queue.clear()
+            self._spare_queues[priority] = queue
+
+        if self._ready_count == 0 and len(self._sleeping) > 0:
+
+            # The next sleeper to wake up is always at the top of the heap
             next_sleeper = self._sleeping[0]
             sleep_nanos = next_sleeper.resume_nanos() - _monotonic_ns()
 
-            if sleep_nanos > 0:
+            if sleep_nanos > 0 and _idle_until_nanos is not None:
+                # Virtual time, jump straight to the next wake-up
+                if self._debug:
+                    print("  No active tasks.  Advancing virtual clock by ", sleep_nanos, "ns")
+                _idle_until_nanos(next_sleeper._resume_nanos)
+            elif sleep_nanos > 0:
                 # Give control to the system, there's nothing to be done right now,
                 # and nothing else is scheduled to run for this long.
                 # This is the real sleep. If/when interrupts are implemented this will likely need to change.
@@ -354,6 +671,7 @@ class Loop:
         """
 
         self._current = task
+        start_nanos = self._current_start_nanos = _monotonic_ns()
         try:
 
             task.coroutine.send(None)
@@ -362,25 +680,38 @@ class Loop:
             # Sleep gate here, in case the current task suspended.
             # If a sleeping task re-suspends it will have already put itself in the sleeping queue.
             if self._current is not None:
-                self._tasks.append(task)
+                self._enqueue(task)
         except StopIteration:
             # This task is all done.
             if self._debug:
                 print("  task complete")
             pass
         finally:
+            task.run_nanos += _monotonic_ns() - start_nanos
             self._current = None
 
-    async def _sleep_until_nanos(self, target_run_nanos):
+    def _current_run_nanos(self):
+        """Time spent running the current task so far, including its ongoing step"""
+        return self._current.run_nanos + _monotonic_ns() - self._current_start_nanos
+
+    def _sleep_until_nanos(self, target_run_nanos, sleeper=None):
         """
         From within a coroutine, sleeps until the target time.monotonic_ns
         Returns the thing to await
+
+        :param sleeper: Optional Sleeper to re-arm instead of allocating a new one.
+            It must not already be in the sleeping heap.
         """
         assert self._current is not None, "You can only sleep from within a task"
-        self._sleeping.append(Sleeper(target_run_nanos, self._current))
+        if sleeper is None:
+            sleeper = Sleeper(target_run_nanos, self._current)
+        else:
+            sleeper._resume_nanos = target_run_nanos
+            sleeper.task = self._current
+        _heap_push(self._sleeping, sleeper)
         if self._debug:
             print("  sleeping ", self._current)
         self._current = None
         # Pretty subtle here.  This yields once, then it continues next time the task scheduler executes it.
-        # The async function is parked at this point.
-        await _yield_once()
+        # The async function is parked at the point where it awaits the returned value.
+        return _YIELD
@@ -1,4 +1,12 @@
 import core.scheduler as scheduler
+from core.data_handler import DataHandler as DH
+
+# Values accepted for "OverrunPolicy" in the SM_CONFIGURATION task entries
+_OVERRUN_POLICIES = {
+    "LOG": scheduler.OVERRUN_LOG,
+    "SKIP": scheduler.OVERRUN_SKIP,
+    "HALVE_RATE": scheduler.OVERRUN_HALVE_RATE,
+}
 
 
 class StateManager:
@@ -17,6 +25,8 @@ class StateManager:
         self.__previous_state = None
         self.__scheduled_tasks = {}
         self.__initialized = False
+        # Scheduler time the task phases are counted from, set by the first state switch
+        self.__period_origin_nanos = None
         self.config = None
         self.task_registry = None
 
@@ -28,12 +38,14 @@ class StateManager:
     def scheduled_tasks(self):
         return self.__scheduled_tasks
 
-    def start(self, start_state: str, SM_CONFIGURATION: dict, TASK_REGISTRY: dict):
+    def start(self, start_state: str, SM_CONFIGURATION: dict, TASK_REGISTRY: dict, run_until_nanos=None):
         """Starts the state machine
 
         Args:
         :param start_state: The state to start the state machine in
         :type start_state: str
+        :param run_until_nanos: Optional scheduler time at which to return (e.g. for virtual-time simulations)
+        :type run_until_nanos: int
         """
 
         self.config = SM_CONFIGURATION
@@ -49,7 +61,7 @@ class StateManager:
 
         # Will load all the tasks through the state switch
         self.switch_to(start_state)
-        scheduler.run()
+        scheduler.run(until_nanos=run_until_nanos)
 
     def switch_to(self, new_state):
         """Switches to a new state and actiavte all corresponding tasks as defined in the SM_CONFIGURATION
@@ -68,39 +80,113 @@ class StateManager:
                 raise ValueError(f"No transition from {self.__current_state} to {new_state}")
         else:
             self.__initialized = True
+            self.__period_origin_nanos = scheduler.time_nanos()
 
         self.__previous_state = self.__current_state
 
         # TODO transition functions
 
-        self.stop_all_tasks()
+        # Write the buffered data to the SD card before changing the task set
+        DH.flush_all()
+
         self.schedule_new_state_tasks(new_state)
 
         print(f"Switched to state {new_state}")
 
     def schedule_new_state_tasks(self, new_state):
+        """Applies the task set of the new state as a delta of the currently scheduled tasks
+
+        Tasks that are not part of the new state are stopped and new tasks are scheduled. Tasks that
+        are in both states keep running on their current schedule, only their rate, priority, phase
+        and budget are updated if the configuration differs. All phases are counted from the same
+        origin, so new tasks are released in step with the tasks that keep running.
 
-        self.__scheduled_tasks = {}  # Reset
+        Args:
+        :param new_state: The name of the state to schedule the tasks of
+        :type new_state: str
+        """
+
+        previous_tasks = self.config[self.__current_state]["Tasks"] if self.__scheduled_tasks else {}
         self.__current_state = new_state
-        state_config = self.config[new_state]
+        new_tasks = self.config[new_state]["Tasks"]
+        phases = self.compute_phases(new_tasks)
+
+        for task_name in list(self.__scheduled_tasks.keys()):
+            if task_name not in new_tasks:
+                self.__scheduled_tasks.pop(task_name).stop()
+
+        for task_name, props in new_tasks.items():
+            task = self.__scheduled_tasks.get(task_name)
 
-        for task_name, props in state_config["Tasks"].items():
+            if task is None:
+                if "ScheduleLater" in props:
+                    schedule = scheduler.schedule_later
+                else:
+                    schedule = scheduler.schedule
 
-            if "ScheduleLater" in props:
-                schedule = scheduler.schedule_later
+                task = schedule(props["Frequency"], self.tasks[task_name]._run, props["Priority"])
+                self.__scheduled_tasks[task_name] = task
             else:
-                schedule = scheduler.schedule
+                previous_props = previous_tasks[task_name]
+                if props["Frequency"] != previous_props["Frequency"]:
+                    task.change_rate(props["Frequency"])
+                if props["Priority"] != previous_props["Priority"]:
+                    task.change_priority(props["Priority"])
+
+            task.set_phase(phases[task_name], self.__period_origin_nanos)
+            self.apply_budget(task_name, task, props)
+
+    def apply_budget(self, task_name, task, props):
+        """Sets (or removes) the time budget of a scheduled task from its configuration entry"""
+        policy = props.get("OverrunPolicy", "LOG")
+        if policy not in _OVERRUN_POLICIES:
+            raise ValueError(f"Unknown overrun policy {policy} for task {task_name}")
+        task.set_budget(props.get("Budget"), _OVERRUN_POLICIES[policy])
 
-            frequency = props["Frequency"]
-            priority = props["Priority"]
-            task_fn = self.tasks[task_name]._run
+    @staticmethod
+    def compute_phases(tasks_config):
+        """Computes the start offset of each task so that tasks with the same frequency are spread over their period
 
-            self.__scheduled_tasks[task_name] = schedule(frequency, task_fn, priority)
+        Tasks with an explicit "Phase" (in seconds) keep it. The other tasks of a given frequency are
+        ordered by priority and released at equal intervals, the highest priority one at the start of the period.
+
+        Args:
+        :param tasks_config: The "Tasks" entry of a state configuration
+        :type tasks_config: dict
+
+        Returns:
+        :return: Dictionary mapping task names to their phase in seconds
+        :rtype: dict
+        """
+        phases = {}
+        groups = {}
+        for task_name, props in tasks_config.items():
+            if "Phase" in props:
+                phases[task_name] = props["Phase"]
+            else:
+                groups.setdefault(props["Frequency"], []).append(task_name)
+
+        for frequency, task_names in groups.items():
+            task_names.sort(key=lambda name: (tasks_config[name]["Priority"], name))
+            interval = 1 / frequency / len(task_names)
+            for i, task_name in enumerate(task_names):
+                phases[task_name] = i * interval
+
+        return phases
 
     def stop_all_tasks(self):
         for name, task in self.__scheduled_tasks.items():
             task.stop()
 
+    def task_metrics(self):
+        """Returns the runtime metrics (core.scheduler.loop.TaskMetrics) of every currently scheduled task
+
+        Returns:
+        :return: Dictionary mapping task names to their metrics
+        :rtype: dict
+        """
+        return {name: task.metrics for name, task in self.__scheduled_tasks.items()}
+
     def query_task_states(self):
         state = {}
         for task in self.__scheduled_tasks:
@@ -2,6 +2,7 @@ import gc
 import sys
 
 from core import state_manager
+from core.data_handler import DataHandler as DH
 from hal.configuration import SATELLITE
 from sm_configuration import SM_CONFIGURATION, TASK_REGISTRY
 
@@ -47,4 +48,6 @@ try:
 
 except Exception as e:
     print("ERROR:", e)
+    # Don't lose the buffered data
+    DH.flush_all()
     # TODO Log the error
@@ -9,7 +9,14 @@ from tasks.timing import Task as timing
 """
 TODO Copy the state descriptions here
 
-
+Task entries:
+    Frequency:      Task rate in Hz
+    Priority:       0 is the highest priority
+    ScheduleLater:  (optional) First run after one period instead of immediately
+    Phase:          (optional) Offset of the task releases within its period in seconds. By default, tasks
+                    with the same frequency are spread evenly over the period in priority order
+    Budget:         (optional) Maximum execution time of a single run in ms
+    OverrunPolicy:  (optional) What to do when the budget is exceeded: "LOG" (default), "SKIP" the next run or "HALVE_RATE"
 """
 
 TASK_REGISTRY = {
@@ -49,7 +56,7 @@ SM_CONFIGURATION = {
             "OBDH": {"Frequency": 1, "Priority": 2},
             "IMU": {"Frequency": 1, "Priority": 5, "ScheduleLater": True},
             "SUN": {"Frequency": 1, "Priority": 5, "ScheduleLater": True},
-            "COMMS": {"Frequency": 0.1, "Priority": 5, "ScheduleLater": True},
+            "COMMS": {"Frequency": 0.1, "Priority": 5, "ScheduleLater": True, "Budget": 5000, "OverrunPolicy": "SKIP"},
         },
         "MovesTo": ["DOWNLINK", "LOW_POWER", "SAFE"],
     },
@@ -58,7 +65,7 @@ SM_CONFIGURATION = {
             "MONITOR": {"Frequency": 1, "Priority": 1},
             "OBDH": {"Frequency": 1, "Priority": 2},
             "IMU": {"Frequency": 1, "Priority": 3},
-            "COMMS": {"Frequency": 0.1, "Priority": 5},
+            "COMMS": {"Frequency": 0.1, "Priority": 5, "Budget": 5000, "OverrunPolicy": "SKIP"},
         },
         "MovesTo": ["NOMINAL"],
     },
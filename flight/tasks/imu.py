@@ -1,6 +1,7 @@
 # from hal.pycubed import hardware
 import time
 
+import core.scheduler as scheduler
 from core import TemplateTask
 from core import state_manager as SM
 from core.data_handler import DataHandler as DH
@@ -33,33 +34,24 @@ class Task(TemplateTask):
         if SM.current_state == "NOMINAL":
 
             if not DH.data_process_exists("imu"):
-                DH.register_data_process("imu", self.data_keys, "ffffffffff", True, line_limit=40)
+                # High-rate stream, the oldest files are evicted beyond 8MB
+                DH.register_data_process("imu", self.data_keys, "ffffffffff", True, line_limit=40, quota=8000000)
 
             # print(f"[{self.ID}][{self.name}] Reading BMX160.")
 
             # SATELLITE.IMU.enable()
 
-            readings = {
-                "accel": SATELLITE.IMU.accel(),
-                "mag": SATELLITE.IMU.mag(),
-                "gyro": SATELLITE.IMU.gyro(),
-            }
+            accel = SATELLITE.IMU.accel()
+            mag = SATELLITE.IMU.mag()
+            gyro = SATELLITE.IMU.gyro()
 
             # SATELLITE.IMU.disable()
 
-            log_data = {
-                "time": time.time(),
-                "accel_x": readings["accel"][0],
-                "accel_y": readings["accel"][1],
-                "accel_z": readings["accel"][2],
-                "mag_x": readings["mag"][0],
-                "mag_y": readings["mag"][1],
-                "mag_z": readings["mag"][2],
-                "gyro_x": readings["gyro"][0],
-                "gyro_y": readings["gyro"][1],
-                "gyro_z": readings["gyro"][2],
-            }
-
-            DH.log_data("imu", log_data)
-
-            print(f"[{self.ID}][{self.name}] Data: {readings}")
+            sample = (time.time(), accel[0], accel[1], accel[2], mag[0], mag[1], mag[2], gyro[0], gyro[1], gyro[2])
+
+            # Values in the order of data_keys, no dictionary needed
+            DH.log_values("imu", *sample)
+            # The radio heartbeat reads the latest sample from the IMU channel
+            scheduler.get_channel("imu").publish(sample)
+
+            print(f"[{self.ID}][{self.name}] Data: {sample}")
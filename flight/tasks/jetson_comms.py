@@ -31,7 +31,8 @@ class Task(TemplateTask):
         # Only communicate if SAT in NOMINAL state
         if SM.current_state == "NOMINAL":
             if not DH.data_process_exists("jetson"):
-                DH.register_data_process("jetson", self.data_keys, "ffff", True, line_limit=40)
+                # The oldest Jetson health files are evicted beyond 1MB
+                DH.register_data_process("jetson", self.data_keys, "ffff", True, line_limit=40, quota=1000000)
 
             # Register image process
             if not DH.data_process_exists("img"):
@@ -41,8 +42,8 @@ class Task(TemplateTask):
             print(f"[{self.ID}][{self.name}] Requesting Jetson for image")
             # msg = Message(TRANSMIT_IMAGE, struct.pack(b, 0))
 
-            # Wait for Jetson comms for 0.1s
-            if not self.argus_comms.receive_message():
+            # Wait for Jetson comms without blocking the other tasks
+            if not await self.argus_comms.receive_message_async():
                 # No message received
                 print(f"[{self.ID}][{self.name}] No message received from Jetson")
 
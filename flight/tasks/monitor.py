@@ -31,6 +31,19 @@ class Task(TemplateTask):
         "reboot_cnt",
     ]
 
+    # One record per scheduled task and per run, time in epoch seconds, durations in microseconds
+    metrics_keys = [
+        "time",
+        "task_id",
+        "run_count",
+        "last_exec_us",
+        "max_exec_us",
+        "mean_exec_us",
+        "max_jitter_us",
+        "overruns",
+        "budget_overruns",
+    ]
+
     system_status = 0x00
     batt_soc = 0
     current = 0
@@ -60,6 +73,29 @@ class Task(TemplateTask):
                 DH.register_data_process("monitor", self.data_keys, "ffffb", True, line_limit=50)
 
             DH.log_data("monitor", readings)
+            self.log_task_metrics(readings["time"])
 
             print(f"[{self.ID}][{self.name}] Data: {readings}")
             print(f"[{self.ID}][{self.name}] {gc.mem_free()} free bytes in memory")
+
+    def log_task_metrics(self, timestamp):
+        """Logs the scheduler metrics of all running tasks to the task_metrics data process"""
+        if not DH.data_process_exists("task_metrics"):
+            # One record per task and per run, the oldest files are evicted beyond 4MB
+            DH.register_data_process("task_metrics", self.metrics_keys, "LBLLLLLLL", True, line_limit=200, quota=4000000)
+
+        for task_name, metrics in SM.task_metrics().items():
+            DH.log_data(
+                "task_metrics",
+                {
+                    "time": int(timestamp),
+                    "task_id": SM.tasks[task_name].ID,
+                    "run_count": metrics.run_count,
+                    "last_exec_us": metrics.last_duration // 1000,
+                    "max_exec_us": metrics.max_duration // 1000,
+                    "mean_exec_us": metrics.mean_duration // 1000,
+                    "max_jitter_us": metrics.max_jitter // 1000,
+                    "overruns": metrics.overruns,
+                    "budget_overruns": metrics.budget_overruns,
+                },
+            )
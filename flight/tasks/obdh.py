@@ -23,12 +23,16 @@ class Task(TemplateTask):
                 self.SD_cleaned = True
             if not self.SD_scanned:
                 DH.scan_SD_card()
+                # Full walk of the SD card, only at boot: the storage counters are then kept up to date in memory
+                DH.reconcile_storage()
                 self.SD_scanned = True
 
             # TODO Temporarily start global state switch here
             # TODO should have a verification checklist in monitor and switch from there
             SM.switch_to("NOMINAL")
         elif SM.current_state == "NOMINAL":
-            self.SD_stored_volume = DH.compute_total_size_files()
+            # Bounded number of deletions per run, a backlog of files over quota is evicted over several runs
+            DH.enforce_quotas()
+            self.SD_stored_volume = DH.get_total_storage_info()[1]
 
         print(f"[{self.ID}][{self.name}] Stored files: {self.SD_stored_volume} bytes.")
@@ -61,7 +61,7 @@ class Task(TemplateTask):
                     self.SAT_RADIO.image_get_info()
 
                 # Transmit message
-                self.tx_header = self.SAT_RADIO.transmit_message()
+                self.tx_header = await self.SAT_RADIO.transmit_message_async()
 
                 # Debug message
                 print(
@@ -69,8 +69,8 @@ class Task(TemplateTask):
                     self.tx_header,
                 )
 
-                # Receive message, blocking for 1s
-                self.flag_ground_station_pass = self.SAT_RADIO.receive_message()
+                # Receive message, waits up to 1s while the other tasks keep running
+                self.flag_ground_station_pass = await self.SAT_RADIO.receive_message_async()
 
                 if self.SAT_RADIO.image_done_transmitting():
                     print(f"[{self.ID}][{self.name}] Image downlinked, deleting with OBDH")
@@ -1,5 +1,6 @@
 # isort: skip_file
 import os
+import struct
 
 import pytest
 
@@ -54,15 +55,701 @@ def test_join_path(input_paths, expected_output):
     assert dh.join_path(*input_paths) == expected_output
 
 
-# TODO - mock filesystem
+@pytest.fixture
+def sd_root(tmp_path):
+    sd_root = tmp_path / "sd"
+    sd_root.mkdir()
+    return str(sd_root)
 
-"""@pytest.fixture
-def sd_root(tmpdir):
-    sd_root = tmpdir.mkdir("sd")
-    return sd_root
 
-def test_scan_sd_card(sd_root):
-    DH.sd_path = str(sd_root)"""
+def make_process(sd_root, **kwargs):
+    return DP("test", ["time", "value"], "If", home_path=sd_root, **kwargs)
+
+
+def list_segments(process):
+    return [list(process.segment(i)) for i in range(process.segment_count())]
+
+
+def test_write_behind_buffer_flushes_by_size(sd_root):
+    process = make_process(sd_root, flush_bytes=16, flush_age=1000)
+
+    process.log({"time": 1, "value": 1.0})
+    assert process.buffered == 8
+    assert os.stat(process.current_path)[6] == 0
+
+    process.log({"time": 2, "value": 2.0})
+    assert process.buffered == 0
+    assert os.stat(process.current_path)[6] == 16
+
+    process.log({"time": 3, "value": 3.0})
+    assert process.buffered == 8
+    process.close()
+    assert process.buffered == 0
+    assert os.stat(process.current_path)[6] == 24
+    assert [record[0] for record in process.read_current_file()] == [1, 2, 3]
+
+
+def test_write_behind_buffer_keeps_remainder(sd_root):
+    # 12-byte records with 16-byte flushes: writes are always whole multiples of flush_bytes
+    process = DP("test", ["time", "a", "b"], "Iff", home_path=sd_root, flush_bytes=16, flush_age=1000)
+    process.log({"time": 1, "a": 1.0, "b": 1.0})
+    process.log({"time": 2, "a": 2.0, "b": 2.0})
+    assert os.stat(process.current_path)[6] == 16
+    assert process.buffered == 8
+    assert [record[0] for record in process.read_segment()] == [1, 2]
+
+
+def test_write_behind_buffer_flushes_by_age(sd_root):
+    process = make_process(sd_root, flush_bytes=512, flush_age=0)
+    process.log({"time": 1, "value": 1.0})
+    assert process.buffered == 0
+    assert os.stat(process.current_path)[6] == 8
+
+
+def test_flush_all(handler):
+    dh.DataHandler.register_data_process("test", ["time", "value"], "If", True, line_limit=10)
+    dh.DataHandler.register_data_process("ram", ["time", "value"], "If", False)
+    dh.DataHandler.log_data("test", {"time": 1, "value": 1.0})
+    dh.DataHandler.log_data("ram", {"time": 1, "value": 1.0})
+
+    process = dh.DataHandler.get_data_process("test")
+    assert process.buffered == 8
+    dh.DataHandler.flush_all()
+    assert process.buffered == 0
+    assert os.stat(process.current_path)[6] == 8
+
+
+def test_storage_counters_without_stat(sd_root, monkeypatch):
+    process = make_process(sd_root, flush_bytes=8, flush_age=1000)
+    process.log({"time": 1, "value": 1.0})  # Opens the file, the only stat call
+
+    def fail_stat(path):
+        raise AssertionError("os.stat called while logging")
+
+    monkeypatch.setattr(dh.os, "stat", fail_stat)
+    for t in range(2, 5):
+        process.log({"time": t, "value": 1.0})
+    monkeypatch.undo()
+
+    assert process.get_current_file_size() == 32
+    assert process.get_storage_info() == (1, 32)
+    assert process.get_storage_info() == process.scan_storage()
+
+
+def test_storage_counters_clean_up(sd_root):
+    process = make_process(sd_root, line_limit=2, flush_bytes=8, flush_age=1000)
+    for t in range(3):  # The third record goes to a new file
+        process.log({"time": t, "value": 1.0})
+    assert process.get_storage_info() == (2, 24)
+
+    tm_path = process.request_TM_path()
+    process.notify_TM_path(tm_path)
+    process.clean_up()
+    assert not os.path.exists(tm_path)
+    assert process.get_storage_info() == (1, 8)
+    assert process.get_storage_info() == process.scan_storage()
+
+    # A new process counts the files already on the SD card
+    process.close()
+    assert make_process(sd_root).get_storage_info() == (1, 8)
+
+
+def test_log_values_matches_log(sd_root):
+    process = make_process(sd_root, flush_bytes=16, flush_age=1000)
+    process.log({"time": 1, "value": 1.5})
+    process.log_values(2, 2.5)
+    assert bytes(process.write_buffer[:16]) == struct.pack("<IfIf", 1, 1.5, 2, 2.5)
+    assert process.get_latest_data() == {"time": 2, "value": 2.5}
+    assert process.read_current_file() == [(1, 1.5), (2, 2.5)]
+
+
+def test_log_values_not_persistent(sd_root):
+    process = DP("ram", ["time", "value"], "If", persistent=False)
+    process.log_values(3, 0.5)
+    assert process.get_latest_data() == {"time": 3, "value": 0.5}
+
+
+def test_segment_start_times_are_unique(sd_root):
+    process = make_process(sd_root, line_limit=1, flush_bytes=8, flush_age=1000)
+    for t in range(4):
+        process.log({"time": t, "value": 1.0})
+    starts = [segment[0] for segment in list_segments(process)]
+    assert starts == sorted(set(starts))
+    assert len(starts) == 4
+    assert [segment[2] for segment in list_segments(process)] == [dh._SEG_CLOSED] * 3 + [dh._SEG_ACTIVE]
+
+
+def test_segment_index_request_notify_clean_up(sd_root):
+    process = make_process(sd_root, line_limit=1, flush_bytes=8, flush_age=1000)
+    for t in range(3):
+        process.log({"time": t, "value": 1.0})
+    paths = [process.segment_path(segment[0]) for segment in list_segments(process)]
+
+    # Oldest first, the file being transmitted is returned again until it is acknowledged
+    assert process.request_TM_path() == paths[0]
+    assert process.request_TM_path() == paths[0]
+    assert list_segments(process)[0][2] == dh._SEG_EXCLUDED
+
+    process.notify_TM_path(paths[0])
+    assert list_segments(process)[0][2] == dh._SEG_DELETE
+    process.notify_TM_path(paths[0])  # Already acknowledged
+    process.notify_TM_path(None)
+    assert process.request_TM_path() == paths[1]
+    process.notify_TM_path(paths[1])
+
+    # The file currently written to is closed when nothing else is available
+    assert process.request_TM_path() == paths[2]
+    assert process.status == dh._OPEN
+    assert process.current_path not in paths
+
+    process.clean_up()
+    assert not os.path.exists(paths[0]) and not os.path.exists(paths[1])
+    assert process.segment_path(list_segments(process)[0][0]) == paths[2]
+
+
+def test_segment_index_cursors(sd_root):
+    process = make_process(sd_root, line_limit=1, flush_bytes=8, flush_age=1000)
+    for t in range(5):
+        process.log({"time": t, "value": 1.0})
+    # The in-memory index is packed like the index file
+    with open(process.dir_path + dh._INDEX_FILENAME, "rb") as file:
+        assert file.read() == process.index
+    assert process.segment_count() == 5
+
+    tm_path = process.request_TM_path()
+    assert process.next_segment(dh._SEG_EXCLUDED) == 0
+    assert process.evict_oldest() == 8
+    assert process.next_segment(dh._SEG_CLOSED) == process.closed_cursor == 2
+
+    # Positions shift when the deleted segments are removed
+    process.clean_up()
+    assert process.next_segment(dh._SEG_EXCLUDED) == 0
+    assert process.next_segment(dh._SEG_CLOSED) == 1
+    process.notify_TM_path(tm_path)
+    assert process.next_segment(dh._SEG_EXCLUDED) is None
+
+    # The cursor stops at the active segment, which is found once closed
+    assert process.evict_oldest() == process.evict_oldest() == 8
+    assert process.evict_oldest() is None
+    process.close()
+    assert process.next_segment(dh._SEG_CLOSED) == 3
+
+
+def test_segment_index_reload(sd_root):
+    process = make_process(sd_root, line_limit=2, flush_bytes=8, flush_age=1000)
+    for t in range(3):
+        process.log({"time": t, "value": 1.0})
+    tm_path = process.request_TM_path()
+    segments = list_segments(process)
+    process.flush()  # Reset without closing the active segment
+
+    reloaded = make_process(sd_root)
+    # The active and excluded segments are closed, with the sizes written on the SD card
+    assert list_segments(reloaded) == [[segments[0][0], 16, dh._SEG_CLOSED], [segments[1][0], 8, dh._SEG_CLOSED]]
+    assert reloaded.request_TM_path() == tm_path
+
+
+def test_segment_index_rebuilt_from_files(sd_root):
+    process = make_process(sd_root, line_limit=1, flush_bytes=8, flush_age=1000)
+    for t in range(3):
+        process.log({"time": t, "value": 1.0})
+    process.close()
+    segments = list_segments(process)
+    os.remove(process.dir_path + dh._INDEX_FILENAME)
+
+    assert list_segments(make_process(sd_root)) == segments
+
+
+def test_total_storage_counters(handler):
+    dh.DataHandler.register_data_process("a", ["time", "value"], "If", True, line_limit=2, flush_bytes=8)
+    dh.DataHandler.register_data_process("b", ["time", "value"], "If", True, line_limit=2, flush_bytes=8)
+    for t in range(3):
+        dh.DataHandler.log_values("a", t, 1.0)
+        dh.DataHandler.log_values("b", t, 1.0)
+
+    assert dh.DataHandler.get_total_storage_info() == (4, 48)
+
+    files, size = dh.DataHandler.reconcile_storage()
+    assert files == 4
+    assert size == dh.DataHandler.compute_total_size_files()
+
+    # Counters out of sync with the SD card are fixed by the reconciliation
+    process = dh.DataHandler.get_data_process("a")
+    process.total_size += 100
+    assert dh.DataHandler.reconcile_storage() == (files, size)
+
+
+@pytest.fixture
+def handler(sd_root):
+    dh.DataHandler.sd_path = sd_root
+    dh.DataHandler.data_process_registry = {}
+    dh.DataHandler.untracked_size = 0
+    dh.DataHandler.total_quota = None
+    dh.DataHandler.cluster_size = 1
+    dh.DataHandler.manifest = {}
+    yield dh.DataHandler
+    dh.DataHandler.total_quota = None
+    dh.DataHandler.cluster_size = 1
+
+
+def fill(handler, tag_name, files, **kwargs):
+    # One 8-byte record per file
+    handler.register_data_process(tag_name, ["time", "value"], "If", True, line_limit=1, flush_bytes=8, **kwargs)
+    for t in range(files):
+        handler.log_values(tag_name, t, 1.0)
+    return handler.get_data_process(tag_name)
+
+
+def test_process_quota_evicts_oldest(handler):
+    process = fill(handler, "a", 6, quota=24)
+    starts = [segment[0] for segment in list_segments(process)]
+    tm_path = process.request_TM_path()  # Being transmitted, never evicted
+
+    assert handler.enforce_quotas(max_evictions=2) == 2
+    assert [segment[0] for segment in list_segments(process)] == [starts[0]] + starts[3:]
+    assert handler.enforce_quotas() == 1
+    assert [segment[0] for segment in list_segments(process)] == [starts[0]] + starts[4:]
+    assert process.get_storage_info() == (3, 24)
+    assert os.path.exists(tm_path)
+    assert handler.enforce_quotas() == 0
+
+
+def test_total_quota_evicts_by_retention_priority(handler):
+    low = fill(handler, "low", 3, retention_priority=10)
+    high = fill(handler, "high", 3, retention_priority=1)
+    handler.total_quota = 24
+
+    assert handler.enforce_quotas() == 3
+    # The lower priority process is evicted first, its active file is kept
+    assert low.get_storage_info() == (1, 8)
+    assert high.get_storage_info() == (2, 16)
+    assert handler.get_total_storage_info() == (3, 24)
+
+
+def test_quotas_count_whole_clusters(handler):
+    handler.cluster_size = 32
+    process = fill(handler, "a", 4, quota=100)
+    assert process.get_storage_info() == (4, 32)
+    assert process.get_allocated_size() == 4 * 32
+
+    assert handler.enforce_quotas() == 1
+    assert process.get_storage_info() == (3, 24)
+    assert process.get_allocated_size() == 3 * 32
+
+    handler.total_quota = 64
+    assert handler.enforce_quotas() == 1
+    assert handler.get_total_allocated_size() == 2 * 32
+
+
+@pytest.mark.parametrize(
+    "t_start, t_end, expected",
+    [
+        (3, 7, [3, 4, 5, 6, 7]),
+        (-5, 2, [0, 1, 2]),
+        (8, 100, [8, 9]),  # Records still in the write buffer
+        (4.5, 4.9, []),
+        (20, 30, []),
+    ],
+)
+def test_query_time_range(handler, t_start, t_end, expected):
+    handler.register_data_process("q", ["time", "value"], "If", True, line_limit=3, flush_bytes=16, flush_age=1000)
+    for t in range(10):
+        handler.log_values("q", t, t / 2)
+
+    assert [record[0] for record in handler.query("q", t_start, t_end)] == expected
+
+
+def test_query_fields(handler):
+    handler.register_data_process("q", ["value", "time"], "fI", True, line_limit=4, flush_bytes=8)
+    for t in range(10):
+        handler.log_values("q", t / 2, t)
+
+    assert list(handler.query("q", 2, 4, fields=["value"])) == [(1.0,), (1.5,), (2.0,)]
+    assert list(handler.query("unknown", 2, 4)) == []
+
+
+def test_read_segment_active_without_closing(sd_root):
+    process = make_process(sd_root, flush_bytes=16, flush_age=1000)
+    for t in range(5):  # 4 records written, 1 buffered
+        process.log_values(t, t / 2)
+    path = process.current_path
+
+    assert [record[0] for record in process.read_segment()] == [0, 1, 2, 3, 4]
+    assert process.status == dh._OPEN
+    assert list(process.read_segment(start_record=3, fields=["value"])) == [(1.5,), (2.0,)]
+
+    process.log_values(5, 2.5)
+    assert process.current_path == path
+    assert [record[0] for record in process.read_current_file()] == [0, 1, 2, 3, 4, 5]
+
+
+def test_read_segment_closed(sd_root):
+    process = make_process(sd_root, line_limit=2, flush_bytes=8, flush_age=1000)
+    for t in range(5):
+        process.log_values(t, 1.0)
+    assert [list(process.read_segment(i)) for i in range(3)] == [[(0, 1.0), (1, 1.0)], [(2, 1.0), (3, 1.0)], [(4, 1.0)]]
+
+
+def test_history_ring_buffer(handler):
+    handler.register_data_process("ram", ["time", "value"], "If", False, history_size=4)
+    process = handler.get_data_process("ram")
+    assert list(handler.get_history("ram")) == []
+
+    handler.log_data("ram", {"time": 0, "value": 0.5})
+    handler.log_values("ram", 1, 1.0)
+    assert list(handler.get_history("ram")) == [(0, 0.5), (1, 1.0)]
+
+    for t in range(2, 7):
+        handler.log_values("ram", t, t / 2)
+    assert process.history_count == 4
+    assert [record[0] for record in handler.get_history("ram")] == [3, 4, 5, 6]
+    assert list(handler.get_history("ram", 2, fields=["value"])) == [(2.5,), (3.0,)]
+    assert len(process.history_buffer) == 4 * process.bytesize
+
+
+def test_image_staging_buffer(sd_root):
+    process = dh.ImageProcess("img", home_path=sd_root)
+    image = bytes(i % 251 for i in range(3000))
+    writes = []
+
+    for offset in range(0, len(image), 60):  # UART payloads
+        process.log(image[offset : offset + 60])
+        writes.append(os.stat(process.current_path)[6])
+
+    # Only whole sectors are written while the image is received
+    assert set(writes) == {0, 2048}
+    assert process.get_current_file_size() == 3000
+
+    path = process.current_path
+    process.image_completed()
+    with open(path, "rb") as file:
+        assert file.read() == image
+    assert process.current_path != path
+
+
+def test_image_discarded(sd_root):
+    process = dh.ImageProcess("img", home_path=sd_root)
+    process.log(bytes(3000))
+    path = process.current_path
+
+    # Truncated transfer: the partial image is deleted instead of being offered for transmission
+    process.image_discarded()
+    assert not dh.path_exist(path)
+    assert process.get_storage_info() == (0, 0)
+    assert process.request_TM_path() is None
+
+    process.log(bytes(10))
+    process.image_completed()
+    assert process.get_storage_info() == (2, 10)
+    # Requested on every pass of a downlink, the same image until it is acknowledged
+    tm_path = process.request_TM_path()
+    assert tm_path is not None and process.request_TM_path() == tm_path
+    process.notify_TM_path(tm_path)
+    assert process.request_TM_path() is None
+
+
+def test_segment_buckets(sd_root, monkeypatch):
+    now = [7100]
+    monkeypatch.setattr(dh.time, "time", lambda: now[0])
+    process = make_process(sd_root, line_limit=1, flush_bytes=8, flush_age=1000)
+    for t in range(4):  # Two segments in bucket 1, two in bucket 2
+        process.log_values(t, 1.0)
+        now[0] += 60
+
+    assert process.segment_path(7100) == process.dir_path + "1/test_7100.bin"
+    assert sorted(os.listdir(process.dir_path + "1")) == ["test_7100.bin", "test_7160.bin"]
+    assert sorted(os.listdir(process.dir_path + "2")) == ["test_7220.bin", "test_7280.bin"]
+    assert process.get_storage_info() == process.scan_storage()
+
+    for _ in range(2):
+        process.notify_TM_path(process.request_TM_path())
+    process.clean_up()
+    assert not os.path.exists(process.dir_path + "1")
+    assert process.find_segment(process.dir_path + "2/test_7220.bin") == 0
+
+
+def test_flat_segments_moved_to_buckets(sd_root):
+    process = make_process(sd_root)
+    os.remove(process.dir_path + dh._INDEX_FILENAME)
+    for start in (3500, 3700):
+        with open(process.dir_path + f"test_{start}.bin", "wb") as file:
+            file.write(struct.pack("<If", start, 1.0))
+
+    process = make_process(sd_root)
+    assert list_segments(process) == [[3500, 8, dh._SEG_CLOSED], [3700, 8, dh._SEG_CLOSED]]
+    assert list(process.read_segment(1)) == [(3700, 1.0)]
+    assert os.path.exists(process.dir_path + "0/test_3500.bin")
+
+
+def test_scan_SD_card_from_manifest(handler, monkeypatch):
+    fill(handler, "a", 3, quota=100)
+    handler.register_image_process()
+    handler.register_data_process("ram", ["time", "value"], "If", False)
+    assert sorted(handler.load_manifest()) == ["a", "img"]
+
+    handler.data_process_registry = {}
+
+    def no_walk(*args):
+        raise AssertionError("SD card walked")
+
+    monkeypatch.setattr(handler, "list_directories", no_walk)
+    monkeypatch.setattr(dh, "path_exist", no_walk)
+    handler.scan_SD_card()
+    assert sorted(handler.data_process_registry) == ["a", "img"]
+    assert handler.get_data_process("a").quota == 100
+    assert handler.get_storage_info("a") == (3, 24)
+
+
+def test_scan_SD_card_restores_options(handler):
+    handler.register_data_process("a", ["time", "value"], "If", True, flush_bytes=64, flush_age=2, history_size=5)
+
+    # Tasks skip the registration of the processes found on the SD card, their options come from the manifest
+    handler.data_process_registry = {}
+    handler.scan_SD_card()
+    process = handler.get_data_process("a")
+    assert (process.flush_bytes, process.flush_age, process.history_size) == (64, 2, 5)
+    handler.log_values("a", 1, 0.5)
+    assert list(handler.get_history("a")) == [(1, 0.5)]
+
+
+def test_scan_SD_card_sets_total_quota(handler, monkeypatch):
+    # 4096-byte fragments, 1000 fragments
+    monkeypatch.setattr(dh.os, "statvfs", lambda path: (4096, 4096, 1000, 500, 500, 0, 0, 0, 0, 255), raising=False)
+    handler.scan_SD_card()
+    assert handler.total_quota == 4096 * 1000 * 90 // 100
+    assert handler.cluster_size == 4096
+
+    # A configured quota is kept
+    handler.total_quota = 1000
+    handler.scan_SD_card()
+    assert handler.total_quota == 1000
+
+
+def test_scan_SD_card_corrupt_manifest(handler):
+    fill(handler, "a", 3)
+    with open(os.path.join(handler.sd_path, dh._MANIFEST_FILENAME), "w") as file:
+        file.write('{"a": {"data_for')
+
+    handler.data_process_registry = {}
+    handler.scan_SD_card()
+    assert list(handler.data_process_registry) == ["a"]
+    assert list(handler.load_manifest()) == ["a"]
+
+
+def test_crc_framing(sd_root):
+    process = make_process(sd_root, flush_bytes=8, flush_age=1000, crc=True)
+    assert process.record_size == 11
+    for t in range(3):
+        process.log_values(t, t / 2)
+    assert os.stat(process.current_path)[6] == 32  # Whole flushes, the third record is split with the buffer
+    assert process.read_current_file() == [(0, 0.0), (1, 0.5), (2, 1.0)]
+
+    # A corrupted record is skipped, the following ones stay aligned
+    process.close()
+    with open(process.current_path, "r+b") as file:
+        file.seek(3)
+        file.write(b"\xff")
+    assert process.read_current_file() == [(1, 0.5), (2, 1.0)]
+    assert list(process.query(1, 2)) == [(1, 0.5), (2, 1.0)]
+
+
+@pytest.mark.parametrize("crc, torn, expected_size", [(False, b"\x01\x02\x03", 24), (True, b"\x00" * 14, 33)])
+def test_torn_tail_recovery(sd_root, crc, torn, expected_size):
+    process = make_process(sd_root, flush_bytes=8, flush_age=1000, crc=crc)
+    for t in range(3):
+        process.log_values(t, 1.0)
+    process.flush()
+    with open(process.current_path, "ab") as file:  # Reset in the middle of a write
+        file.write(torn)
+
+    path = process.current_path
+    process = make_process(sd_root, crc=crc)
+    assert list_segments(process)[0][1] == expected_size
+    assert [record[0] for record in process.read_segment(0)] == [0, 1, 2]
+    # The torn tail is removed from the file, the counters match the SD card
+    assert os.stat(path)[6] == expected_size
+    assert not os.path.exists(path + ".tmp")
+    assert process.get_storage_info() == process.scan_storage()
+
+
+def test_torn_tail_copy_failure(sd_root, monkeypatch):
+    process = make_process(sd_root, line_limit=1, flush_bytes=8, flush_age=1000)
+    for t in range(3):
+        process.log_values(t, 1.0)
+    process.flush()
+    with open(process.current_path, "ab") as file:
+        file.write(b"\x01")
+
+    def fail(self, path, size):
+        raise OSError("SD card error")
+
+    monkeypatch.setattr(DP, "copy_segment", fail)
+    process = make_process(sd_root)
+    assert [segment[1] for segment in list_segments(process)] == [8, 8, 8]
+    assert process.get_storage_info() == (3, 24)
+
+
+def test_compressed_segments(handler):
+    handler.register_data_process("z", ["time", "value"], "If", True, line_limit=4, flush_bytes=8, quantization={"value": 100})
+    process = handler.get_data_process("z")
+    for t in range(10):
+        handler.log_values("z", t, t / 4)
+
+    # Deltas of 1 and 0.25: one varint byte per field instead of 8-byte records (the first value of the second
+    # segment is encoded against 0 and takes two bytes), the active segment is not compressed
+    assert [segment[1] for segment in list_segments(process)[:2]] == [8, 9]
+    assert process.get_storage_info() == process.scan_storage() == (3, 8 + 9 + 16)
+    assert list(process.read_segment(1)) == [(4, 1.0), (5, 1.25), (6, 1.5), (7, 1.75)]
+    assert list(process.read_segment(0, start_record=2, fields=["value"])) == [(0.5,), (0.75,)]
+    assert list(handler.query("z", 3, 8, fields=["time"])) == [(t,) for t in range(3, 9)]
+    assert handler.load_manifest()["z"]["quantization"] == {"value": 100}
+
+
+def test_compressed_encoding_round_trip(sd_root):
+    process = DP("z", ["time", "a", "b"], "ifh", home_path=sd_root, line_limit=100, quantization={"a": 1000})
+    records = [(-(7**t), ((-1) ** t) * t * 12.345, 1000 - t * 300) for t in range(12)]
+    for record in records:
+        process.log_values(*record)
+    process.close()
+    assert [(r[0], round(r[1], 3), r[2]) for r in process.read_segment()] == [
+        (r[0], round(struct.unpack("<f", struct.pack("<f", r[1]))[0], 3), r[2]) for r in records
+    ]
+
+
+def test_compressed_segment_recovery(sd_root):
+    process = DP("z", ["time", "value"], "If", home_path=sd_root, flush_bytes=8, quantization={"value": 10})
+    for t in range(3):
+        process.log_values(t, 1.0)
+    # Reset with the active segment not compressed
+    process = DP("z", ["time", "value"], "If", home_path=sd_root, quantization={"value": 10})
+    assert list_segments(process)[0][1] == 6
+    assert list(process.read_segment(0)) == [(0, 1.0), (1, 1.0), (2, 1.0)]
+
+
+def test_compressed_non_finite_values(sd_root):
+    process = DP("z", ["time", "value"], "If", home_path=sd_root, quantization={"value": 100})
+    samples = [float("nan"), float("inf"), -float("inf"), 2.0**40, -(2.0**40), 1.5]
+    for t, value in enumerate(samples):
+        process.log_values(t, value)
+    process.close()
+
+    values = [record[1] for record in process.read_segment()]
+    assert values[0] != values[0]
+    assert values[1:] == [float("inf"), -float("inf"), 2.0**40, -(2.0**40), 1.5]
+
+
+def test_compressed_epoch_timestamps(handler):
+    # Float timestamps at epoch scale with a resolution of one second, as logged by the tasks
+    handler.register_data_process("e", ["time", "value"], "ff", True, line_limit=3, quantization={"time": 1, "value": 10})
+    times = [1760000000 + 128 * t for t in range(5)]  # Exact float32 values
+    for t in times:
+        handler.log_values("e", t, 0.5)
+    process = handler.get_data_process("e")
+    assert process.is_compressed(0)
+
+    assert [record[0] for record in process.read_segment(0)] == times[:3]
+    assert list(handler.query("e", times[1], times[3], fields=["time"])) == [(t,) for t in times[1:4]]
+
+
+def test_failed_compression_keeps_segment_raw(sd_root, monkeypatch):
+    process = DP("z", ["time", "value"], "If", home_path=sd_root, line_limit=2, flush_bytes=8, quantization={"value": 10})
+
+    def fail(i):
+        with open(process.segment_path(list_segments(process)[i][0]) + ".tmp", "wb") as file:
+            file.write(b"\x00")
+        raise OSError("SD card error")
+
+    monkeypatch.setattr(process, "compress_segment", fail)
+    for t in range(3):  # The rotation does not raise
+        process.log_values(t, t / 2)
+
+    path = process.segment_path(list_segments(process)[0][0])
+    assert list_segments(process)[0] == [list_segments(process)[0][0], 16, dh._SEG_CLOSED]
+    assert not os.path.exists(path + ".tmp")
+    assert list(process.read_segment(0)) == [(0, 0.0), (1, 0.5)]
+
+    # The raw segment is still read as such after a reset, the following ones are compressed
+    process = DP("z", ["time", "value"], "If", home_path=sd_root, quantization={"value": 10})
+    assert list_segments(process)[0][2] == dh._SEG_CLOSED
+    assert list(process.read_segment(0)) == [(0, 0.0), (1, 0.5)]
+    assert list(process.read_segment(1)) == [(2, 1.0)]
+    assert list_segments(process)[1][1] == 2
+
+
+def test_quantization_required_for_float_fields(sd_root):
+    with pytest.raises(ValueError):
+        DP("z", ["time", "value"], "If", home_path=sd_root, quantization={})
+
+
+def test_columnar_segments(sd_root):
+    # 10-byte records with 24-byte flushes: blocks of 2 records, written field by field
+    process = DP("c", ["time", "a", "b"], "IfH", home_path=sd_root, flush_bytes=24, flush_age=1000, columnar=True)
+    for t in range(5):
+        process.log_values(t, t / 2, 100 + t)
+    assert os.stat(process.current_path)[6] == 40
+    assert process.buffered == 10
+    with open(process.current_path, "rb") as file:
+        assert struct.unpack("<IIffHH", file.read(20)) == (0, 1, 0.0, 0.5, 100, 101)
+
+    records = [(t, t / 2, 100 + t) for t in range(5)]
+    assert list(process.read_segment()) == records
+    assert list(process.read_segment(start_record=1, fields=["b", "time"])) == [(100 + t, t) for t in range(1, 5)]
+
+    # The last block of the closed segment holds a single record
+    process.close()
+    assert os.stat(process.current_path)[6] == 50
+    assert list(process.read_segment(0)) == records
+    assert list(process.read_segment(0, start_record=4, fields=["a"])) == [(2.0,)]
+
+
+def test_columnar_query(handler):
+    handler.register_data_process("c", ["time", "value"], "If", True, line_limit=5, flush_bytes=16, columnar=True)
+    for t in range(12):
+        handler.log_values("c", t, t / 4)
+
+    assert list(handler.query("c", 3, 8, fields=["value"])) == [(t / 4,) for t in range(3, 9)]
+    assert [record[0] for record in handler.query("c", 0, 11)] == list(range(12))
+    assert handler.load_manifest()["c"]["columnar"]
+
+
+def test_columnar_forced_flush(handler):
+    handler.register_data_process("c", ["time", "value"], "If", True, flush_bytes=16, flush_age=1000, columnar=True)
+    for t in range(3):
+        handler.log_values("c", t, t / 4)
+    process = handler.get_data_process("c")
+    assert process.buffered == 8
+
+    # The partial block is written as the end of the segment, the next record starts a new one
+    handler.flush_all()
+    assert process.buffered == 0
+    assert list_segments(process)[0][1:] == [24, dh._SEG_CLOSED]
+    assert list(process.read_segment(0)) == [(t, t / 4) for t in range(3)]
+
+    handler.log_values("c", 3, 0.75)
+    assert len(list_segments(process)) == 2
+    assert [record[0] for record in handler.query("c", 0, 3)] == [0, 1, 2, 3]
+
+
+def test_columnar_block_size_restored(handler):
+    handler.register_data_process("c", ["time", "value"], "If", True, line_limit=5, flush_bytes=24, columnar=True)
+    for t in range(7):
+        handler.log_values("c", t, t / 4)
+
+    # The block size follows flush_bytes, which must survive a reboot to read the files back
+    handler.data_process_registry = {}
+    handler.scan_SD_card()
+    process = handler.get_data_process("c")
+    assert process.block_records == 3
+    assert list(process.read_segment(0)) == [(t, t / 4) for t in range(5)]
+    assert [record[0] for record in handler.query("c", 0, 6)] == list(range(5))
+
+
+def test_columnar_excludes_crc_and_quantization(sd_root):
+    with pytest.raises(ValueError):
+        make_process(sd_root, columnar=True, crc=True)
+    with pytest.raises(ValueError):
+        make_process(sd_root, columnar=True, quantization={"value": 10})
+
 
 if __name__ == "__main__":
     pytest.main()
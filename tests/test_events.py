@@ -0,0 +1,96 @@
+# isort: skip_file
+import pytest
+
+import tests.cp_mock  # noqa: F401
+from flight.core.scheduler.events import Channel, Event, Queue, QueueEmpty, QueueFull
+from flight.core.scheduler.loop import Loop
+
+
+def test_event_wakes_waiters():
+    loop = Loop()
+    event = Event(loop)
+    woken = []
+
+    async def waiter(name):
+        await event.wait()
+        woken.append(name)
+
+    loop.add_task(waiter("a"), 1)
+    loop.add_task(waiter("b"), 2)
+    loop._step()
+    assert woken == []
+    assert loop._ready_count == 0  # Waiting tasks are not polled
+
+    event.set()
+    loop._step()
+    assert woken == ["a", "b"]
+    assert event.is_set()
+
+
+def test_event_already_set():
+    loop = Loop()
+    event = Event(loop)
+    event.set()
+    done = []
+
+    async def waiter():
+        await event.wait()
+        done.append(True)
+
+    loop.add_task(waiter(), 1)
+    loop._step()
+    assert done == [True]
+
+
+def test_queue_nowait():
+    queue = Queue(2, Loop())
+    queue.put_nowait(1)
+    queue.put_nowait(2)
+    assert queue.full()
+    with pytest.raises(QueueFull):
+        queue.put_nowait(3)
+    assert queue.get_nowait() == 1
+    queue.put_nowait(3)  # Wraps around the ring buffer
+    assert queue.get_nowait() == 2
+    assert queue.get_nowait() == 3
+    with pytest.raises(QueueEmpty):
+        queue.get_nowait()
+
+
+def test_queue_producer_consumer():
+    loop = Loop()
+    queue = Queue(1, loop)
+    received = []
+
+    async def consumer():
+        for _ in range(3):
+            received.append(await queue.get())
+
+    async def producer():
+        for i in range(3):
+            await queue.put(i)
+
+    loop.add_task(consumer(), 1)
+    loop.add_task(producer(), 2)
+    loop.run()
+    assert received == [0, 1, 2]
+
+
+def test_channel_drops_oldest_for_slow_subscribers():
+    loop = Loop()
+    channel = Channel(loop)
+    fast = channel.subscribe(maxsize=4)
+    slow = channel.subscribe(maxsize=1)
+
+    for i in range(3):
+        channel.publish(i)
+
+    assert channel.last == 2
+    assert [fast.get_nowait() for _ in range(fast.qsize())] == [0, 1, 2]
+    assert slow.qsize() == 1
+    assert slow.get_nowait() == 2
+
+    channel.unsubscribe(slow)
+    channel.publish(3)
+    assert slow.empty()
+    assert fast.get_nowait() == 3
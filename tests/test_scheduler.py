@@ -0,0 +1,390 @@
+# isort: skip_file
+import time
+
+import pytest
+
+import tests.cp_mock  # noqa: F401
+import flight.core.scheduler.loop as sched
+from flight.core.scheduler.loop import Loop
+
+
+@pytest.fixture
+def clock():
+    virtual = sched.use_virtual_clock()
+    yield virtual
+    sched.set_time_provider(time.monotonic_ns)
+
+
+def test_sleeping_heap_pops_in_wake_order(clock):
+    loop = Loop()
+    order = []
+
+    def make(name, delay):
+        async def sleeper():
+            await loop.sleep(delay / 1000)
+            order.append(name)
+
+        return sleeper()
+
+    for name, delay, priority in [("c", 3, 1), ("a", 1, 2), ("b", 2, 3), ("d", 4, 0)]:
+        loop.add_task(make(name, delay), priority)
+
+    loop._step()  # Every task goes to sleep
+    assert len(loop._sleeping) == 4
+    assert loop._sleeping[0].task.priority == 2  # Earliest wake-up on top
+
+    for t in range(1, 5):
+        clock.nanos = t * 1000000
+        loop._step()
+
+    assert order == ["a", "b", "c", "d"]
+    assert not loop._sleeping
+
+
+def test_due_sleepers_run_by_priority(clock):
+    loop = Loop()
+    order = []
+
+    def make(name):
+        async def sleeper():
+            await loop.sleep(0.001)
+            order.append(name)
+
+        return sleeper()
+
+    loop.add_task(make("low"), 5)
+    loop.add_task(make("high"), 1)
+    loop.add_task(make("mid"), 3)
+    loop._step()
+
+    clock.nanos = 5000000
+    loop._step()
+    assert order == ["high", "mid", "low"]
+
+
+def test_scheduled_task_fixed_rate(clock):
+    loop = Loop()
+    run_count = 0
+
+    async def foo():
+        nonlocal run_count
+        run_count += 1
+
+    loop.schedule(1000, foo, 1)
+    loop._step()
+    assert run_count == 1
+
+    clock.nanos = 500000
+    loop._step()
+    assert run_count == 1, "does not run before its period"
+
+    clock.nanos = 1000000
+    loop._step()
+    assert run_count == 2
+
+
+def test_scheduled_task_reuses_sleeper(clock):
+    loop = Loop()
+
+    async def foo():
+        pass
+
+    task = loop.schedule(0.1, foo, 1)
+    assert task._nanoseconds_per_invocation == 10000000000
+    assert isinstance(task._nanoseconds_per_invocation, int)
+    task.change_rate(1000)
+    assert task._nanoseconds_per_invocation == 1000000
+
+    loop._step()
+    assert loop._sleeping == [task._sleeper]
+
+    for t in range(1, 4):
+        clock.nanos = t * 1000000
+        loop._step()
+        assert loop._sleeping == [task._sleeper]
+        assert task._sleeper.resume_nanos() == (t + 1) * 1000000
+
+
+def test_yield_once_is_shared():
+    assert sched._yield_once() is sched._yield_once()
+
+
+def test_task_metrics(clock):
+    loop = Loop()
+
+    async def slow():
+        clock.nanos += 3000000  # Runs for 3ms
+
+    task = loop.schedule(1000, slow, 1)  # 1ms period, always falls behind
+    loop._step()
+    loop._step()
+
+    metrics = task.metrics
+    assert metrics.run_count == 2
+    assert metrics.last_duration == 3000000
+    assert metrics.max_duration == 3000000
+    assert metrics.mean_duration == 3000000
+    assert metrics.overruns == 2
+    assert metrics.max_jitter == 0
+
+
+def test_task_metrics_jitter(clock):
+    loop = Loop()
+
+    async def foo():
+        pass
+
+    task = loop.schedule(1000, foo, 1)
+    loop._step()
+    clock.nanos = 1250000  # Woken up 250us late
+    loop._step()
+    assert task.metrics.last_jitter == 250000
+    assert task.metrics.overruns == 0
+
+
+def test_virtual_clock_jumps_to_next_sleeper(clock):
+    loop = Loop()
+
+    async def foo():
+        pass
+
+    loop.schedule(0.5, foo, 1)
+    loop._step()  # Runs once, then idles until the next period
+    assert clock.nanos == 2000000000
+
+
+def test_virtual_clock_simulates_hours(clock):
+    loop = Loop()
+    counts = {"fast": 0, "slow": 0}
+
+    async def fast():
+        counts["fast"] += 1
+
+    async def slow():
+        counts["slow"] += 1
+
+    loop.schedule(1, fast, 1)
+    loop.schedule(0.1, slow, 2)
+
+    start = time.monotonic()
+    loop.run(until_nanos=3600 * 1000000000)
+    assert time.monotonic() - start < 10
+
+    assert counts["fast"] == 3600
+    assert counts["slow"] == 360
+    assert clock.nanos == 3600 * 1000000000
+
+
+def test_ready_queues_priority_then_fifo(clock):
+    loop = Loop()
+    order = []
+
+    def make(name):
+        async def task():
+            order.append(name)
+
+        return task()
+
+    loop.add_task(make("p3-first"), 3)
+    loop.add_task(make("p1"), 1)
+    loop.add_task(make("p3-second"), 3)
+    loop.add_task(make("p0"), 0)
+    loop._step()
+    assert order == ["p0", "p1", "p3-first", "p3-second"]
+    assert loop._ready_count == 0
+
+
+def test_requeued_task_runs_on_next_step(clock):
+    loop = Loop()
+    count = 0
+
+    async def spinner():
+        nonlocal count
+        while True:
+            count += 1
+            await sched._yield_once()
+
+    loop.add_task(spinner(), 2)
+    loop._step()
+    assert count == 1
+    loop._step()
+    assert count == 2
+
+
+@pytest.mark.parametrize("priority", [-1, sched.PRIORITY_LEVELS])
+def test_invalid_priority(priority):
+    loop = Loop()
+
+    async def foo():
+        pass
+
+    coroutine = foo()
+    with pytest.raises(ValueError):
+        loop.add_task(coroutine, priority)
+    coroutine.close()
+
+
+def test_wait_for_predicate(clock):
+    loop = Loop()
+    ready = False
+    results = []
+
+    async def waiter():
+        results.append(await loop.wait_for(lambda: ready, timeout=1, poll_hz=10))
+
+    async def producer():
+        nonlocal ready
+        await loop.sleep(0.35)
+        ready = True
+
+    loop.add_task(waiter(), 1)
+    loop.add_task(producer(), 2)
+    loop.run()
+    assert results == [True]
+    assert clock.nanos == 400000000  # Seen on the first poll after the producer ran
+
+
+def test_wait_for_timeout(clock):
+    loop = Loop()
+    results = []
+    other_runs = 0
+
+    async def waiter():
+        results.append(await loop.wait_for(lambda: False, timeout=0.25, poll_hz=10))
+        results.append(clock.nanos)
+
+    async def other():
+        nonlocal other_runs
+        other_runs += 1
+
+    loop.add_task(waiter(), 1)
+    task = loop.schedule(20, other, 2)
+    while not results:
+        loop._step()
+    task.stop()
+
+    assert results == [False, 250000000]
+    assert other_runs == 6  # The loop kept running other tasks while waiting
+
+
+def test_wait_for_reuses_sleeper(clock, monkeypatch):
+    loop = Loop()
+    created = 0
+
+    class CountingSleeper(sched.Sleeper):
+        def __init__(self, resume_nanos, task):
+            nonlocal created
+            created += 1
+            super().__init__(resume_nanos, task)
+
+    monkeypatch.setattr(sched, "Sleeper", CountingSleeper)
+
+    async def waiter():
+        await loop.wait_for(lambda: clock.nanos >= 100000000, poll_hz=100)
+
+    loop.add_task(waiter(), 1)
+    loop.run()
+    assert clock.nanos == 100000000
+    assert created == 1  # Ten polls, a single Sleeper
+
+
+@pytest.mark.parametrize(
+    "policy, expected_runs, expected_period",
+    [
+        (sched.OVERRUN_LOG, 10, 100000000),
+        (sched.OVERRUN_SKIP, 5, 100000000),
+        (sched.OVERRUN_HALVE_RATE, 3, 800000000),
+    ],
+)
+def test_budget_overrun_policies(clock, policy, expected_runs, expected_period):
+    loop = Loop()
+
+    async def slow():
+        clock.nanos += 20000000  # 20ms
+
+    task = loop.schedule(10, slow, 1)
+    task.set_budget(10, policy)
+    loop.run(until_nanos=1000000000)
+    task.stop()
+
+    assert task.metrics.run_count == expected_runs
+    assert task.metrics.budget_overruns == expected_runs
+    assert task._nanoseconds_per_invocation == expected_period
+
+
+def test_budget_excludes_suspended_time(clock):
+    loop = Loop()
+
+    async def waiting():
+        clock.nanos += 2000000
+        await loop.sleep(0.05)  # Other tasks run meanwhile
+        clock.nanos += 3000000
+
+    async def other():
+        clock.nanos += 20000000
+
+    task = loop.schedule(10, waiting, 1)
+    task.set_budget(10, sched.OVERRUN_SKIP)
+    other_task = loop.schedule(50, other, 2)
+    loop.run(until_nanos=1000000000)
+    task.stop()
+    other_task.stop()
+
+    assert task.metrics.max_duration == 5000000
+    assert task.metrics.budget_overruns == 0
+
+
+def test_halve_rate_bounded_and_recovered(clock):
+    loop = Loop()
+    slow = True
+
+    async def maybe_slow():
+        if slow:
+            clock.nanos += 20000000
+
+    task = loop.schedule(10, maybe_slow, 1)
+    task.set_budget(10, sched.OVERRUN_HALVE_RATE)
+    loop.run(until_nanos=5000000000)
+    assert task._nanoseconds_per_invocation == 800000000  # At most 8 times slower
+
+    slow = False
+    loop.run(until_nanos=8000000000)
+    task.stop()
+    assert task._nanoseconds_per_invocation == 100000000
+
+
+def test_budget_not_exceeded(clock):
+    loop = Loop()
+
+    async def fast():
+        clock.nanos += 5000000
+
+    task = loop.schedule(10, fast, 1)
+    task.set_budget(10, sched.OVERRUN_SKIP)
+    loop.run(until_nanos=1000000000)
+    task.stop()
+    assert task.metrics.run_count == 10
+    assert task.metrics.budget_overruns == 0
+
+
+def test_invalid_overrun_policy():
+    async def foo():
+        pass
+
+    task = sched.ScheduledTask(Loop(), 1, foo, 1, (), {})
+    with pytest.raises(ValueError):
+        task.set_budget(10, 42)
+
+
+def test_phase_offsets_first_run(clock):
+    loop = Loop()
+    runs = []
+
+    async def foo():
+        runs.append(clock.nanos)
+
+    task = loop.schedule(1, foo, 1)
+    task.set_phase(0.25)
+    loop.run(until_nanos=3000000000)
+    task.stop()
+    assert runs == [250000000, 1250000000, 2250000000]
@@ -0,0 +1,129 @@
+# isort: skip_file
+import time
+
+import pytest
+
+import tests.cp_mock  # noqa: F401
+from flight.core.state_machine import StateManager
+
+
+@pytest.mark.parametrize(
+    "tasks_config, expected",
+    [
+        (
+            {
+                "OBDH": {"Frequency": 1, "Priority": 3},
+                "MONITOR": {"Frequency": 1, "Priority": 1},
+                "TIMING": {"Frequency": 1, "Priority": 2},
+                "IMU": {"Frequency": 2, "Priority": 3},
+            },
+            {"MONITOR": 0.0, "TIMING": 1 / 3, "OBDH": 2 / 3, "IMU": 0.0},
+        ),
+        (
+            {
+                "MONITOR": {"Frequency": 1, "Priority": 1},
+                "OBDH": {"Frequency": 1, "Priority": 2},
+                "COMMS": {"Frequency": 0.1, "Priority": 5, "Phase": 0.3},
+            },
+            {"MONITOR": 0.0, "OBDH": 0.5, "COMMS": 0.3},
+        ),
+    ],
+)
+def test_compute_phases(tasks_config, expected):
+    phases = StateManager.compute_phases(tasks_config)
+    assert phases.keys() == expected.keys()
+    for task_name, phase in expected.items():
+        assert phases[task_name] == pytest.approx(phase)
+
+
+CONFIGURATION = {
+    "A": {
+        "Tasks": {
+            "MONITOR": {"Frequency": 1, "Priority": 1},
+            "OBDH": {"Frequency": 1, "Priority": 2},
+            "TIMING": {"Frequency": 1, "Priority": 3},
+        },
+        "MovesTo": ["B"],
+    },
+    "B": {
+        "Tasks": {
+            "MONITOR": {"Frequency": 1, "Priority": 1},
+            "OBDH": {"Frequency": 2, "Priority": 4, "Budget": 10},
+            "IMU": {"Frequency": 1, "Priority": 5},
+        },
+        "MovesTo": ["A"],
+    },
+}
+
+
+class CountingTask:
+    def __init__(self):
+        self.runs = 0
+        self.release_nanos = []
+
+    async def _run(self):
+        import core.scheduler
+
+        self.runs += 1
+        self.release_nanos.append(core.scheduler.time_nanos())
+
+
+@pytest.fixture
+def state_manager():
+    import core.scheduler
+    import core.scheduler.loop
+
+    clock = core.scheduler.loop.use_virtual_clock()
+    sm = StateManager()
+    sm.config = CONFIGURATION
+    sm.states = list(CONFIGURATION.keys())
+    sm.tasks = {name: CountingTask() for name in ["MONITOR", "OBDH", "TIMING", "IMU"]}
+    yield sm, clock
+    # Let the stopped coroutines exit
+    sm.stop_all_tasks()
+    core.scheduler.run()
+    core.scheduler.loop.set_time_provider(time.monotonic_ns)
+
+
+def test_transition_only_applies_task_delta(state_manager):
+    import core.scheduler
+
+    sm, clock = state_manager
+    sm.switch_to("A")
+    before = dict(sm.scheduled_tasks)
+    core.scheduler.run(until_nanos=500000000)
+    monitor_runs = sm.tasks["MONITOR"].runs
+    assert monitor_runs == 1
+
+    sm.switch_to("B")
+    after = sm.scheduled_tasks
+    assert after.keys() == {"MONITOR", "OBDH", "IMU"}
+    assert after["MONITOR"] is before["MONITOR"]
+    assert after["OBDH"] is before["OBDH"]
+    assert after["OBDH"]._nanoseconds_per_invocation == 500000000
+    assert after["OBDH"]._priority == 4
+    assert after["OBDH"]._budget_nanos == 10000000
+    assert before["TIMING"]._stop
+
+    # MONITOR keeps its schedule, it is not run again by the transition
+    core.scheduler.run(until_nanos=999999999)
+    assert sm.tasks["MONITOR"].runs == monitor_runs
+    core.scheduler.run(until_nanos=1000000001)
+    assert sm.tasks["MONITOR"].runs == monitor_runs + 1
+
+
+def test_transition_keeps_phases_aligned(state_manager):
+    import core.scheduler
+
+    sm, clock = state_manager
+    sm.switch_to("A")
+    core.scheduler.run(until_nanos=300000000)
+    assert clock.nanos == 333333333
+    sm.switch_to("B")
+    core.scheduler.run(until_nanos=2100000000)
+
+    # IMU is staggered with MONITOR from the common origin, not from the time of the switch
+    assert sm.tasks["MONITOR"].release_nanos == [0, 1000000000, 2000000000]
+    assert sm.tasks["IMU"].release_nanos == [500000000, 1500000000]
+    # OBDH runs at the time set in A, then follows its 2Hz schedule
+    assert sm.tasks["OBDH"].release_nanos == [333333333, 500000000, 1000000000, 1500000000, 2000000000]